@@ -0,0 +1,232 @@
+import os
+import random
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from database.redis import redis_client
+
+# Seconds a chat thread is kept after its last message (0 = forever)
+CHAT_THREAD_TTL_SECONDS = int(os.getenv("CHAT_THREAD_TTL_SECONDS", 7 * 24 * 3600))
+
+# A small schema of how chat threads are stored in Redis:
+# Latest checkpoint of a thread:
+# Key: chat:checkpoint:{thread_id}:{checkpoint_ns}
+# Value: A Redis Hash
+#   - checkpoint_id, parent_checkpoint_id
+#   - checkpoint_type, checkpoint: Serialized checkpoint (channel values included)
+#   - metadata_type, metadata: Serialized checkpoint metadata
+#
+# Pending writes of that checkpoint:
+# Key: chat:writes:{thread_id}:{checkpoint_ns}:{checkpoint_id}
+# Value: A Redis Hash {"{task_id}:{idx}": serialized (channel, value, task_path)}
+#
+# Keys of a thread (so it can be deleted without pattern matching on its ID):
+# Key: chat:thread:{thread_id}
+# Value: A Redis Set with the checkpoint and writes key names above
+#
+# Every key of a thread expires CHAT_THREAD_TTL_SECONDS after its last update.
+
+def _checkpoint_key(thread_id: str, checkpoint_ns: str) -> str:
+    return f"chat:checkpoint:{thread_id}:{checkpoint_ns}"
+
+def _writes_key(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> str:
+    return f"chat:writes:{thread_id}:{checkpoint_ns}:{checkpoint_id}"
+
+def _thread_key(thread_id: str) -> str:
+    return f"chat:thread:{thread_id}"
+
+def _pack(typed: Tuple[str, bytes]) -> bytes:
+    """Joins a serde (type, data) pair into one Redis value."""
+    type_, data = typed
+    return type_.encode("utf-8") + b":" + data
+
+def _unpack(value: bytes) -> Tuple[str, bytes]:
+    type_, data = value.split(b":", 1)
+    return type_.decode("utf-8"), data
+
+class RedisCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer that keeps the latest checkpoint of each thread in
+    Redis, so conversations survive restarts and are shared by every API worker.
+
+    Only the newest checkpoint per thread is stored (the chat never rewinds to
+    older ones), which keeps each thread to a few small keys. Async only: the API
+    always runs the graph with ainvoke/astream.
+    """
+
+    def __init__(self, client=redis_client, ttl_seconds: int = CHAT_THREAD_TTL_SECONDS, *, serde=None):
+        super().__init__(serde=serde)
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+
+    def _tuple_config(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    async def _load_tuple(self, thread_id: str, checkpoint_ns: str,
+                          checkpoint_id: Optional[str] = None) -> Optional[CheckpointTuple]:
+        data = await self.client.hgetall(_checkpoint_key(thread_id, checkpoint_ns))
+        if not data:
+            return None
+        stored_id = data[b"checkpoint_id"].decode("utf-8")
+        if checkpoint_id and checkpoint_id != stored_id:
+            return None
+
+        writes = await self.client.hgetall(_writes_key(thread_id, checkpoint_ns, stored_id))
+        pending_writes = []
+        for field in sorted(writes, key=lambda f: (f.rsplit(b":", 1)[0], int(f.rsplit(b":", 1)[1]))):
+            task_id = field.rsplit(b":", 1)[0].decode("utf-8")
+            channel, value, _ = self.serde.loads_typed(_unpack(writes[field]))
+            pending_writes.append((task_id, channel, value))
+
+        parent_id = data.get(b"parent_checkpoint_id", b"").decode("utf-8")
+        return CheckpointTuple(
+            config=self._tuple_config(thread_id, checkpoint_ns, stored_id),
+            checkpoint=self.serde.loads_typed(
+                (data[b"checkpoint_type"].decode("utf-8"), data[b"checkpoint"])
+            ),
+            metadata=self.serde.loads_typed(
+                (data[b"metadata_type"].decode("utf-8"), data[b"metadata"])
+            ),
+            parent_config=self._tuple_config(thread_id, checkpoint_ns, parent_id) if parent_id else None,
+            pending_writes=pending_writes,
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        return await self._load_tuple(
+            configurable["thread_id"], configurable.get("checkpoint_ns", ""), get_checkpoint_id(config)
+        )
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        if config:
+            # Exact keys only: the thread ID is never used as a SCAN pattern
+            configurable = config["configurable"]
+            thread_id = configurable["thread_id"]
+            if "checkpoint_ns" in configurable:
+                namespaces = [configurable["checkpoint_ns"]]
+            else:
+                prefix = _checkpoint_key(thread_id, "").encode("utf-8")
+                members = await self.client.smembers(_thread_key(thread_id))
+                namespaces = sorted(m[len(prefix):].decode("utf-8") for m in members if m.startswith(prefix))
+            locations = [(thread_id, ns) for ns in namespaces]
+        else:
+            locations = []
+            async for key in self.client.scan_iter(match=_checkpoint_key("*", "*"), count=500):
+                thread_id, checkpoint_ns = await self.client.hmget(key, "thread_id", "checkpoint_ns")
+                if thread_id is not None:
+                    locations.append((thread_id.decode("utf-8"), (checkpoint_ns or b"").decode("utf-8")))
+
+        before_id = get_checkpoint_id(before) if before else None
+        found = 0
+        for thread_id, checkpoint_ns in locations:
+            checkpoint_tuple = await self._load_tuple(thread_id, checkpoint_ns, get_checkpoint_id(config) if config else None)
+            if checkpoint_tuple is None:
+                continue
+            if before_id and checkpoint_tuple.checkpoint["id"] >= before_id:
+                continue
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            found += 1
+            if limit and found >= limit:
+                return
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        parent_id = configurable.get("checkpoint_id")
+        key = _checkpoint_key(thread_id, checkpoint_ns)
+        thread_key = _thread_key(thread_id)
+
+        checkpoint_type, checkpoint_data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+                "parent_checkpoint_id": parent_id or "",
+                "checkpoint_type": checkpoint_type,
+                "checkpoint": checkpoint_data,
+                "metadata_type": metadata_type,
+                "metadata": metadata_data,
+            })
+            if parent_id and parent_id != checkpoint["id"]:
+                # The previous checkpoint is replaced, so are its pending writes
+                parent_writes = _writes_key(thread_id, checkpoint_ns, parent_id)
+                pipe.delete(parent_writes)
+                pipe.srem(thread_key, parent_writes)
+            pipe.sadd(thread_key, key)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+                pipe.expire(thread_key, self.ttl_seconds)
+            await pipe.execute()
+
+        return self._tuple_config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        configurable = config["configurable"]
+        key = _writes_key(configurable["thread_id"], configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"])
+        thread_key = _thread_key(configurable["thread_id"])
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            for idx, (channel, value) in enumerate(writes):
+                field = f"{task_id}:{WRITES_IDX_MAP.get(channel, idx)}"
+                packed = _pack(self.serde.dumps_typed((channel, value, task_path)))
+                if channel in WRITES_IDX_MAP:
+                    # Special channels (errors, interrupts...) replace earlier writes
+                    pipe.hset(key, field, packed)
+                else:
+                    pipe.hsetnx(key, field, packed)
+            pipe.sadd(thread_key, key)
+            if self.ttl_seconds:
+                pipe.expire(key, self.ttl_seconds)
+                pipe.expire(thread_key, self.ttl_seconds)
+            await pipe.execute()
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        thread_key = _thread_key(thread_id)
+        keys = await self.client.smembers(thread_key)
+        await self.client.delete(thread_key, *keys)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        """Same monotonically increasing string versions as InMemorySaver."""
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
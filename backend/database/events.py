@@ -0,0 +1,67 @@
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from database.redis import redis_client, OCR_EVENTS_CHANNEL
+
+# Events published by the OCR worker on OCR_EVENTS_CHANNEL (JSON):
+#   {"type": "document_ready", "file_id": ..., "original_filename": ...}
+#   {"type": "status", "processing_complete": true|false}
+# The API adds {"type": "context_ready", ...} once the chat context is reloaded.
+
+def format_sse(data: Dict, event: Optional[str] = None) -> str:
+    """Formats one Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+class EventBroadcaster:
+    """
+    Fans out events to every connected client of this API process, one bounded
+    queue per client. A client that stops reading loses its oldest events
+    instead of blocking the others.
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._queues: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue)
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._queues.discard(queue)
+
+    def publish(self, event: Dict):
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+broadcaster = EventBroadcaster()
+
+async def listen_ocr_events(handler: Callable[[Dict], Awaitable[None]], retry_delay: int = 5):
+    """
+    Subscribes to the OCR worker's events and awaits handler(event) for each one.
+    Runs until cancelled, resubscribing if the Redis connection drops.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(OCR_EVENTS_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                try:
+                    event = json.loads(message["data"])
+                except ValueError:
+                    continue
+                await handler(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in OCR events listener: {e}")
+            await asyncio.sleep(retry_delay)
+        finally:
+            await pubsub.aclose()
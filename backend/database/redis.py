@@ -3,14 +3,24 @@ import redis.asyncio as redis
 from pathlib import Path
 from schemas.File import FileUploadError
 from fastapi import UploadFile
-from typing import Dict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import hashlib
 import uuid
 
+from utils.file import CHUNK_SIZE, MAX_FILE_SIZE
+
 # Redis configuration
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "devpass123")
 
+FILENAME_INDEX_KEY = "md:filename_to_id"
+OCR_JOBS_STREAM = "ocr:jobs"
+OCR_JOBS_MAXLEN = 10_000
+CHUNK_INDEX_IDS_KEY = "md:chunk_ids"
+OCR_EVENTS_CHANNEL = "ocr:events"
+MARKDOWN_BATCH_SIZE = int(os.getenv("MARKDOWN_BATCH_SIZE", 100))
+
 # Redis client (async mode)
 redis_client = redis.Redis(
     host=REDIS_HOST,
@@ -31,22 +41,98 @@ redis_client = redis.Redis(
 #   - original_filename: The original sanitized filename (string)
 #   - content_type: The MIME type of the file (string)
 #   - size_bytes: The size of the file in bytes (integer)
+#   - sha256: Hex SHA-256 digest of the content (streamed uploads only)
+#   - status: "failed" once the OCR worker gave up on the file (its content is
+#     deleted); uploading the same PDF again queues it again
+#
+# Streamed uploads are appended to pdf:upload:{uuid} in CHUNK_SIZE pieces and
+# then renamed to pdf:content:{sha256} together with the metadata, so workers
+# never see a partial file and identical uploads share one file ID.
+#
+# OCR job queue:
+# Key: ocr:jobs
+# Value: A Redis Stream with one entry per file to convert ({"file_id": ...}),
+#   consumed by the OCR worker through a consumer group
+#
+# Chunk index (written by the OCR worker next to md:content:{file_id}):
+# Key: md:chunks:{file_id}
+# Value: A Redis Hash with the document's chunks and embeddings
+#   - texts: JSON list of chunk texts
+#   - vectors: Row-major float32 embedding matrix as raw bytes
+#   - count, dim: Matrix shape
+#   - model, chunk_size, overlap: Parameters the index was built with
+# Key: md:chunk_ids
+# Value: A Redis Set of the file IDs that have a chunk index
+#
+# Filename index:
+# Key: md:filename_to_id
+# Value: A Redis Hash mapping original filenames to file IDs
+#
+# Chat sessions: chat:checkpoint:* and chat:writes:* (see database/checkpointer.py)
+#
+# OCR events:
+# Channel: ocr:events
+# Value: Pub/sub JSON messages from the OCR worker (see database/events.py)
 
-async def save_pdf_to_redis(file_id: str, file_content: bytes, metadata: Dict):
+async def save_pdf_stream_to_redis(file: UploadFile, metadata: Dict) -> Dict:
     """
-    Saves PDF content and its metadata to Redis using a transaction.
+    Streams an uploaded PDF into Redis in CHUNK_SIZE pieces using APPEND,
+    computing its size and SHA-256 on the fly so memory use stays constant
+    regardless of file size.
+
+    The file ID is the SHA-256 of the content. If that content was already
+    converted to Markdown (or is already queued), the upload is discarded
+    and the existing entry is reused instead of being processed again. A
+    failed or orphaned entry (metadata without content) does not count: the
+    upload replaces it and is queued again.
+
+    Returns the stored metadata plus a `deduplicated` flag.
     """
-    content_key = f"pdf:content:{file_id}"
-    meta_key = f"pdf:meta:{file_id}"
+    staging_key = f"pdf:upload:{uuid.uuid4()}"
+    digest = hashlib.sha256()
+    size = 0
 
     try:
-        # Save content and metadata to Redis in a single transaction
+        await file.seek(0)
+        while chunk := await file.read(CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE:
+                raise FileUploadError(
+                    f"File exceeds the maximum size of {MAX_FILE_SIZE // (1024*1024)}MB"
+                )
+            digest.update(chunk)
+            await redis_client.append(staging_key, chunk)
+
+        file_id = digest.hexdigest()
+        content_key = f"pdf:content:{file_id}"
+        meta_key = f"pdf:meta:{file_id}"
+        metadata = {**metadata, "id": file_id, "size_bytes": size, "sha256": file_id}
+
+        # Same content already processed or queued: one hash, one round-trip
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.exists(f"md:content:{file_id}")
+            pipe.hget(meta_key, "status")
+            pipe.exists(meta_key, content_key)
+            converted, status, queued = await pipe.execute()
+        if converted or (queued == 2 and status != b"failed"):
+            await redis_client.delete(staging_key)
+            await redis_client.hset(FILENAME_INDEX_KEY, metadata["original_filename"], file_id)
+            return {**metadata, "deduplicated": True}
+
+        # Publish content, metadata and the OCR job together once the content is complete
         async with redis_client.pipeline(transaction=True) as pipe:
-            pipe.set(content_key, file_content)
+            pipe.delete(meta_key)  # a failed or orphaned previous attempt
+            pipe.rename(staging_key, content_key)
             pipe.hset(meta_key, mapping=metadata)
+            pipe.xadd(OCR_JOBS_STREAM, {"file_id": file_id}, maxlen=OCR_JOBS_MAXLEN, approximate=True)
             await pipe.execute()
+        return {**metadata, "deduplicated": False}
     except Exception as e:
-        raise FileUploadError(f"Error saving file to Redis: {str(e)}")
+        # Never leave a half-written file behind
+        await redis_client.delete(staging_key)
+        if isinstance(e, FileUploadError):
+            raise
+        raise FileUploadError(f"Error streaming file to Redis: {str(e)}")
 
 async def set_processing_status(is_processing: bool):
     """
@@ -61,4 +147,103 @@ async def get_processing_status() -> bool:
     status_bytes = await redis_client.get("processing_status")
     if status_bytes is None:
         return False  # Default to False if the key doesn't exist
-    return status_bytes.decode('utf-8').lower() == 'true'
\ No newline at end of file
+    return status_bytes.decode('utf-8').lower() == 'true'
+
+async def get_chunk_indexes(file_ids: List[str], batch_size: int = MARKDOWN_BATCH_SIZE) -> Dict[str, Dict[bytes, bytes]]:
+    """
+    Stored chunk indexes of the given documents, one pipelined round-trip per
+    batch. Documents without one are left out.
+    """
+    indexes = {}
+    for start in range(0, len(file_ids), batch_size):
+        batch = file_ids[start:start + batch_size]
+        results = await _fetch_batch([f"md:chunks:{file_id}".encode("utf-8") for file_id in batch])
+        indexes.update({file_id: data for file_id, data in zip(batch, results) if data})
+    return indexes
+
+async def save_chunk_index(file_id: str, fields: Dict):
+    """
+    Stores (or replaces) the chunk index of a document.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(f"md:chunks:{file_id}")
+        pipe.hset(f"md:chunks:{file_id}", mapping=fields)
+        pipe.sadd(CHUNK_INDEX_IDS_KEY, file_id)
+        await pipe.execute()
+
+async def delete_chunk_index(file_id: str):
+    """
+    Removes the chunk index of a document.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.delete(f"md:chunks:{file_id}")
+        pipe.srem(CHUNK_INDEX_IDS_KEY, file_id)
+        await pipe.execute()
+
+async def prune_chunk_indexes() -> int:
+    """
+    Removes the chunk indexes (listed in md:chunk_ids) whose Markdown no longer
+    exists. Returns how many were removed.
+    """
+    file_ids = [member.decode("utf-8") for member in await redis_client.smembers(CHUNK_INDEX_IDS_KEY)]
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for file_id in file_ids:
+            pipe.exists(f"md:content:{file_id}")
+        exists = await pipe.execute()
+    orphans = [file_id for file_id, found in zip(file_ids, exists) if not found]
+    for file_id in orphans:
+        await delete_chunk_index(file_id)
+    return len(orphans)
+
+async def _fetch_batch(keys: List[bytes], fields: Optional[List[str]] = None) -> List[Dict[bytes, bytes]]:
+    """One pipelined round-trip: HGETALL per key, or HMGET of just `fields`."""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in keys:
+            if fields:
+                pipe.hmget(key, fields)
+            else:
+                pipe.hgetall(key)
+        results = await pipe.execute()
+    if fields:
+        results = [
+            {field.encode("utf-8"): value for field, value in zip(fields, values) if value is not None}
+            for values in results
+        ]
+    return results
+
+async def iter_markdown_docs(batch_size: int = MARKDOWN_BATCH_SIZE,
+                             fields: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Dict[bytes, bytes]]]:
+    """
+    Yields (file_id, md:content hash) for every converted document as it arrives.
+    Keys are found with SCAN (never blocks Redis like KEYS) and fetched with one
+    pipelined HGETALL per batch, i.e. about one round-trip per batch_size documents.
+    With `fields`, only those hash fields are read (e.g. the version, not the content).
+    """
+    seen = set()
+    batch = []
+    async for key in redis_client.scan_iter(match="md:content:*", count=batch_size):
+        if key in seen:  # SCAN may return a key more than once
+            continue
+        seen.add(key)
+        batch.append(key)
+        if len(batch) >= batch_size:
+            for key_done, data in zip(batch, await _fetch_batch(batch, fields)):
+                if data:
+                    yield key_done.decode("utf-8").split(":")[-1], data
+            batch = []
+    if batch:
+        for key_done, data in zip(batch, await _fetch_batch(batch, fields)):
+            if data:
+                yield key_done.decode("utf-8").split(":")[-1], data
+
+async def get_markdown_docs(file_ids: List[str], batch_size: int = MARKDOWN_BATCH_SIZE) -> Dict[str, Dict[bytes, bytes]]:
+    """
+    Fetches the md:content hash of the given documents, one pipelined round-trip
+    per batch. Documents that no longer exist are left out.
+    """
+    docs = {}
+    for start in range(0, len(file_ids), batch_size):
+        batch = file_ids[start:start + batch_size]
+        results = await _fetch_batch([f"md:content:{file_id}".encode("utf-8") for file_id in batch])
+        docs.update({file_id: data for file_id, data in zip(batch, results) if data})
+    return docs
@@ -1,128 +1,376 @@
-from typing import List
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from langchain_core.messages import HumanMessage, BaseMessage
+from langchain_core.messages import AIMessageChunk, HumanMessage, BaseMessage, RemoveMessage, SystemMessage
 from langchain.chat_models import init_chat_model
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import START, MessagesState, StateGraph
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END, START, MessagesState, StateGraph
+from langchain_core.prompts import ChatPromptTemplate
 
 # Import from other modules
-from database.redis import redis_client
+from database.checkpointer import RedisCheckpointSaver
+from database.events import broadcaster
+from database.redis import (
+    redis_client,
+    get_chunk_indexes,
+    save_chunk_index,
+    prune_chunk_indexes,
+    iter_markdown_docs,
+    get_markdown_docs,
+    get_processing_status,
+)
 from models.config import ContextoGeneral
+from models.retrieval import (EMBEDDING_MODEL, ChunkIndex, build_chunk_index, decode_chunk_index,
+                              embed_texts, encode_chunk_index)
+from models.law_index import load_law_index
+
+@dataclass(frozen=True)
+class ChatContext:
+    """
+    Everything a chat turn reads about the loaded documents. A reload builds a
+    new one and swaps it in with a single assignment, so in-flight turns keep
+    the snapshot they started with.
+    """
+    documents: Dict[str, Tuple[str, str, str]]   # file_id -> (version, filename, markdown), by filename
+    markdown_unido: str
+    document_index: Optional[ChunkIndex]
+    prompt_prefix: List[BaseMessage]             # static start of every prompt (see build_prompt_prefix)
 
 # Global variables for the app state
 app_llm = None
-markdown_unido_global = None
-memory = MemorySaver()
+chat_context: Optional[ChatContext] = None
+reload_lock = asyncio.Lock()
+# Reloads triggered by OCR events are coalesced: at most one running and one queued
+_reload_task: Optional[asyncio.Task] = None
+_reload_requested = False
+# "retrieval": only the chunks relevant to each question go in the prompt.
+# "full": every document is sent on every turn.
+CHAT_CONTEXT_MODE = os.getenv("CHAT_CONTEXT_MODE", "retrieval")
+# Conversations live in Redis: they survive restarts and are shared by every API worker
+memory = RedisCheckpointSaver()
+# Above CHAT_MAX_HISTORY messages, all but the last CHAT_KEEP_RECENT are folded into a summary
+# (at least the last question and its answer are kept)
+CHAT_KEEP_RECENT = max(int(os.getenv("CHAT_KEEP_RECENT", 6)), 2)
+CHAT_MAX_HISTORY = max(int(os.getenv("CHAT_MAX_HISTORY", 20)), CHAT_KEEP_RECENT)
+# Each chat session is its own LangGraph thread; clients without a session share this one
 CONVERSATION_THREAD_ID = "conv_unica"
-config = {"configurable": {"thread_id": CONVERSATION_THREAD_ID}}
 model = init_chat_model("gpt-4o-mini", model_provider="openai", temperature=0)
+# Upper bound on LLM requests in flight across all sessions; the rest wait without blocking the loop
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+llm_slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
-async def get_all_markdown_docs():
-    """Obtiene todos los contenidos Markdown desde Redis y los concatena."""
-    md_keys = await redis_client.keys("md:content:*")
-    if not md_keys:
-        return None, None
-    
-    contenido_total = []
-    nombres = []
-    for key in md_keys:
-        data = await redis_client.hgetall(key)
+# Compiled once; rendered only when the documents change
+SYSTEM_TEMPLATE = ChatPromptTemplate.from_messages([("system", ContextoGeneral)])
+DOCUMENTS_TEMPLATE = ChatPromptTemplate.from_messages(
+    [("system", ContextoGeneral), ("system", "Documentos en Markdown:\n{markdown}")]
+)
+
+class ChatState(MessagesState):
+    summary: str
+
+def session_config(session_id: Optional[str] = None) -> dict:
+    """LangGraph config for the thread of a chat session."""
+    return {"configurable": {"thread_id": session_id or CONVERSATION_THREAD_ID}}
+
+def _version(data: Dict[bytes, bytes]) -> str:
+    return data.get(b"version", b"").decode("utf-8")
+
+async def get_changed_markdown_docs(loaded: Dict[str, Tuple[str, str, str]]):
+    """
+    Compares the documents in Redis with the loaded ones using only their
+    version field. Returns ({file_id: (version, filename, markdown)} of the new
+    or changed documents, [file_ids that were deleted]).
+    """
+    versions = {}
+    # original_filename is always set, so documents without a version still show up
+    async for file_id, data in iter_markdown_docs(fields=["version", "original_filename"]):
+        versions[file_id] = _version(data)
+    # Sin versión (convertidos antes de que el worker la escribiera): se comparan por contenido
+    candidates = [
+        file_id for file_id, version in versions.items()
+        if not version or file_id not in loaded or loaded[file_id][0] != version
+    ]
+    removed = [file_id for file_id in loaded if file_id not in versions]
+
+    changed = {}
+    fetched = await get_markdown_docs(candidates)
+    # Borrados entre el escaneo y la lectura
+    removed += [file_id for file_id in candidates if file_id in loaded and file_id not in fetched]
+    for file_id, data in fetched.items():
         markdown = data.get(b"content", b"").decode("utf-8")
         filename = data.get(b"original_filename", b"unknown").decode("utf-8")
-        if markdown:
-            contenido_total.append(f"# Documento: {filename}\n\n{markdown}")
-            nombres.append(filename)
-    markdown_unido = "\n\n---\n\n".join(contenido_total)
-    return markdown_unido, nombres
+        if not markdown:
+            removed.append(file_id)
+            continue
+        version = _version(data)
+        if not version:
+            version = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+            await redis_client.hset(f"md:content:{file_id}", "version", version)
+        if file_id in loaded and loaded[file_id][0] == version:
+            continue
+        changed[file_id] = (version, filename, markdown)
+    return changed, sorted(set(removed) & set(loaded))
+
+async def build_document_index(documentos, index: Optional[ChunkIndex] = None) -> ChunkIndex:
+    """
+    Adds documents ({file_id: (filename, markdown)}) to the retrieval index,
+    using the chunk indexes stored in Redis by the OCR worker. Documents
+    without a (compatible) stored index are embedded here once and written
+    back so later reloads can reuse them.
+    """
+    index = index if index is not None else ChunkIndex()
+    stored_indexes = await get_chunk_indexes(list(documentos))
+    for file_id, (filename, markdown) in documentos.items():
+        stored = decode_chunk_index(stored_indexes.get(file_id, {}))
+        if stored is None:
+            stored = await asyncio.to_thread(build_chunk_index, markdown)
+            await save_chunk_index(file_id, encode_chunk_index(*stored))
+        index.add(file_id, filename, *stored)
+    return index
 
-def call_model(state: MessagesState):
+def build_prompt_prefix(markdown_unido: Optional[str], document_index: Optional[ChunkIndex]) -> List[BaseMessage]:
+    """
+    Renders the part of the prompt that only changes on reload: the system
+    context and, in "full" mode, every document. It goes first and is reused
+    byte for byte on every turn, so provider-side prompt caching can hit.
+    """
+    if document_index is not None:
+        return SYSTEM_TEMPLATE.format_messages()
+    return DOCUMENTS_TEMPLATE.format_messages(markdown=markdown_unido or "")
+
+def retrieve_context(document_index: ChunkIndex, query: str) -> str:
+    """Chunks (and law articles) most relevant to the question. CPU-bound: embeds the query once."""
+    query_vector = embed_texts([query])[0]
+    markdown = document_index.build_context(query, query_vector=query_vector)
+    law_index = load_law_index()
+    if law_index is not None:
+        # Relevant articles of the procurement law (LAW_INDEX_DIR)
+        markdown += "\n\n---\n\n# Documento: Ley Orgánica del Sistema Nacional de Contratación Pública\n\n"
+        same_model = law_index.meta["model"] == EMBEDDING_MODEL
+        markdown += law_index.build_context(query, query_vector=query_vector if same_model else None)
+    return markdown
+
+async def call_model(state: ChatState, config: RunnableConfig):
     """
     Invokes the LLM with the current conversation state and the system prompt.
-    This function is a node in the LangGraph workflow.
-    """
-    # The prompt is re-invoked with the latest state
-    prompt_template = ChatPromptTemplate.from_messages(
-        [
-            ("system", ContextoGeneral),
-            ("system", "Documentos en Markdown:\n{markdown}"),
-            MessagesPlaceholder(variable_name="messages"),
-        ]
-    ).partial(markdown=markdown_unido_global)
-    
-    prompt = prompt_template.invoke(state)
-    response = model.invoke(prompt)
+    This function is a node in the LangGraph workflow; it never blocks the
+    event loop (embedding runs in a thread, the LLM call is awaited).
+    """
+    context = chat_context  # one snapshot for the whole turn
+    if context is None:
+        raise Exception("The LLM model is not ready. No documents were loaded.")
+    messages = list(state["messages"])
+    prompt = list(context.prompt_prefix)
+    if state.get("summary"):
+        prompt.append(SystemMessage(f"Resumen de la conversación anterior:\n{state['summary']}"))
+
+    if context.document_index is not None:
+        # Only the chunks most similar to the latest question, placed right
+        # before it so the prefix and the earlier turns stay cacheable
+        last_index = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), None)
+        query = messages[last_index].content if last_index is not None else ""
+        markdown = await asyncio.to_thread(retrieve_context, context.document_index, query)
+        retrieved = SystemMessage(f"Documentos en Markdown:\n{markdown}")
+        if last_index is None:
+            messages.append(retrieved)
+        else:
+            messages.insert(last_index, retrieved)
+
+    async with llm_slots:
+        # config carries the streaming callbacks of astream(stream_mode="messages")
+        response = await model.ainvoke(prompt + messages, config)
     return {"messages": response}
 
-async def initialize_llm_workflow():
+def should_summarize(state: ChatState) -> str:
+    return "summarize" if len(state["messages"]) > CHAT_MAX_HISTORY else END
+
+async def summarize_history(state: ChatState):
     """
-    Initializes the LangGraph workflow with the latest documents.
+    Folds the oldest turns into the running summary and removes them from the
+    thread, so the prompt stays about the same size however long the chat gets.
     """
-    global app_llm, markdown_unido_global
+    messages = state["messages"]
+    cut = max(len(messages) - CHAT_KEEP_RECENT, 0)
+    # The kept window starts at a question, never in the middle of a turn
+    while cut < len(messages) and not isinstance(messages[cut], HumanMessage):
+        cut += 1
+    old = messages[:cut]
+    if not old:
+        return {}
 
-    markdown_unido, nombres = await get_all_markdown_docs()
-    if not markdown_unido:
-        print("No hay documentos Markdown en Redis.")
-        markdown_unido_global = None
-        app_llm = None
-        return
-    
-    print(f"Documentos cargados desde Redis: {', '.join(nombres)}")
-    print(f"Total de documentos: {len(nombres)}")
-    markdown_unido_global = markdown_unido
+    transcript = "\n".join(f"{m.type}: {m.content}" for m in old)
+    previous = state.get("summary", "")
+    async with llm_slots:
+        response = await model.ainvoke([
+            SystemMessage(
+                "Resume la conversación entre el usuario y el asistente en pocas líneas, conservando "
+                "preguntas, datos concretos (montos, plazos, cláusulas, documentos) y conclusiones. "
+                "Integra el resumen previo si existe."
+            ),
+            HumanMessage(f"Resumen previo:\n{previous or '(ninguno)'}\n\nConversación:\n{transcript}"),
+        ])
+    return {"summary": response.content, "messages": [RemoveMessage(id=m.id) for m in old]}
 
-    # Refactorizado: Se crea una nueva instancia de StateGraph cada vez.
-    workflow = StateGraph(state_schema=MessagesState)
+def build_chat_graph():
+    workflow = StateGraph(state_schema=ChatState)
     workflow.add_edge(START, "model")
     workflow.add_node("model", call_model)
-    app_llm = workflow.compile(checkpointer=memory)
-
-    # Initializing the graph with an empty state
-    try:
-        # Check if the thread exists to avoid invoking the graph unnecessarily
-        state = await app_llm.get_state(config)
-        if not state:
-            # If no history exists, initialize it with a clean state.
-            await app_llm.acreate_checkpoint(config, {"messages": []})
-        else:
-            print("Conversation history found. Not resetting on reload.")
-    except Exception as e:
-        print(f"Error during initial graph invocation: {e}")
+    workflow.add_node("summarize", summarize_history)
+    workflow.add_conditional_edges("model", should_summarize, ["summarize", END])
+    workflow.add_edge("summarize", END)
+    # Threads are created on their first message; histories are independent of reloads
+    return workflow.compile(checkpointer=memory)
+
+async def refresh_chat_context() -> Optional[ChatContext]:
+    """
+    Brings the chat context up to date with Redis, loading only new or changed
+    documents and dropping deleted ones. The new context is built on the side
+    and swapped in atomically.
+    """
+    global chat_context
+    async with reload_lock:
+        current = chat_context
+        loaded = current.documents if current else {}
+        changed, removed = await get_changed_markdown_docs(loaded)
+        # Every refresh, changes or not: also catches documents deleted while the API was down
+        pruned = await prune_chunk_indexes()
+        if pruned:
+            print(f"Índices de fragmentos huérfanos eliminados: {pruned}")
+        if current is not None and not changed and not removed:
+            print("Documentos sin cambios.")
+            return current
+
+        documents = {file_id: doc for file_id, doc in loaded.items() if file_id not in removed}
+        documents.update(changed)
+        if not documents:
+            print("No hay documentos Markdown en Redis.")
+            chat_context = None
+            return None
+        documents = dict(sorted(documents.items(), key=lambda item: (item[1][1], item[0])))
+        print(f"Documentos: {len(changed)} nuevos o modificados, {len(removed)} eliminados, {len(documents)} en total")
+
+        document_index = None
+        if CHAT_CONTEXT_MODE == "retrieval":
+            # Copy-on-write: turns in flight keep searching the previous index
+            document_index = current.document_index.copy() if current and current.document_index else ChunkIndex()
+            for file_id in removed:
+                document_index.remove(file_id)
+            await build_document_index(
+                {file_id: (filename, markdown) for file_id, (_, filename, markdown) in changed.items()},
+                document_index,
+            )
+            print(f"Índice de recuperación: {len(document_index)} fragmentos")
+
+        markdown_unido = "\n\n---\n\n".join(
+            f"# Documento: {filename}\n\n{markdown}" for _, filename, markdown in documents.values()
+        )
+        chat_context = ChatContext(
+            documents=documents,
+            markdown_unido=markdown_unido,
+            document_index=document_index,
+            prompt_prefix=build_prompt_prefix(markdown_unido, document_index),
+        )
+        return chat_context
+
+def warm_up_retrieval():
+    """
+    Loads what every question needs up front (embedding model, memory-mapped
+    law index) so the first question does not pay for it. CPU-bound.
+    """
+    embed_texts(["warm-up"])
+    law_index = load_law_index()
+    if law_index is not None:
+        law_index.search("warm-up")
+
+async def initialize_llm_workflow():
+    """
+    Compiles the chat graph and warms up retrieval (once per process), then
+    loads the documents.
+    """
+    global app_llm
+    if app_llm is None:
+        app_llm = build_chat_graph()
+        if CHAT_CONTEXT_MODE == "retrieval":
+            await asyncio.to_thread(warm_up_retrieval)
+    await refresh_chat_context()
 
 async def reload_documents_context():
-    """Reloads documents and updates the LLM context."""
+    """Reloads new or changed documents and updates the LLM context."""
     await initialize_llm_workflow()
-    if not app_llm:
+    if chat_context is None:
         raise Exception("No documents found to load. Context reset.")
+
+def request_reload():
+    """
+    Schedules a context reload in the background. Events that arrive while one
+    is running are folded into a single follow-up reload.
+    """
+    global _reload_task, _reload_requested
+    _reload_requested = True
+    if _reload_task is None or _reload_task.done():
+        _reload_task = asyncio.create_task(_reload_worker())
+
+async def _reload_worker():
+    global _reload_requested
+    while _reload_requested:
+        _reload_requested = False
+        try:
+            context = await refresh_chat_context()
+            documents = len(context.documents) if context else 0
+            processing_complete = await get_processing_status()
+            broadcaster.publish({
+                "type": "context_ready",
+                "documents": documents,
+                "processing_complete": processing_complete,
+                "ready": processing_complete and documents > 0,
+            })
+        except Exception as e:
+            print(f"Error reloading documents: {e}")
+
+def is_chat_ready() -> bool:
+    return app_llm is not None and chat_context is not None
+
+def _ensure_ready():
+    if not is_chat_ready():
+        raise Exception("The LLM model is not ready. No documents were loaded.")
     
-async def chat_with_assistant_service(message: str) -> str:
+async def chat_with_assistant_service(message: str, session_id: Optional[str] = None) -> str:
     """Handles a single chat turn."""
-    if not app_llm:
-        raise Exception("The LLM model is not ready. No documents were loaded.")
+    _ensure_ready()
     
     user_message = HumanMessage(content=message)
-    output = await app_llm.ainvoke({"messages": [user_message]}, config)
+    output = await app_llm.ainvoke({"messages": [user_message]}, session_config(session_id))
     return output["messages"][-1].content
 
-async def get_chat_history_service() -> List[BaseMessage]:
-    """Retrieves the full conversation history."""
-    if not app_llm:
-        raise Exception("The LLM model is not ready. No documents were loaded.")
+def stream_chat_with_assistant_service(message: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Handles a single chat turn, yielding the answer as it is generated.
+    Readiness is checked up front so the caller can fail before streaming.
+    """
+    _ensure_ready()
+
+    async def tokens():
+        user_message = HumanMessage(content=message)
+        async for chunk, metadata in app_llm.astream(
+            {"messages": [user_message]}, session_config(session_id), stream_mode="messages"
+        ):
+            if isinstance(chunk, AIMessageChunk) and chunk.content and metadata.get("langgraph_node") == "model":
+                yield chunk.content
+
+    return tokens()
+
+async def get_chat_history_service(session_id: Optional[str] = None) -> List[BaseMessage]:
+    """Retrieves the full conversation history of a session."""
+    _ensure_ready()
     
-    state = await app_llm.aget_state(config)
+    state = await app_llm.aget_state(session_config(session_id))
     return state.values.get("messages", []) if state else []
 
-async def reset_conversation_service():
-    """Clears the conversation history."""
-    if not app_llm:
-        raise Exception("The LLM model is not ready. No documents were loaded.")
+async def reset_conversation_service(session_id: Optional[str] = None):
+    """Clears the conversation history of a session."""
+    _ensure_ready()
     
-    await app_llm.checkpointer.put(
-        config=config["configurable"],
-        checkpoint={
-            "v": 1,
-            "ts": "2023-01-01T00:00:00.000Z",
-            "id": "reset",
-            "channel_values": {"messages": []},
-        }
-    )
\ No newline at end of file
+    await memory.adelete_thread(session_config(session_id)["configurable"]["thread_id"])
@@ -0,0 +1,70 @@
+"""
+Chunk index of a Markdown document: how it is split, embedded and stored in
+the md:chunks:{file_id} hash. Shared by the API (models/retrieval.py) and the
+OCR worker (bot/chunk_index.py, which gets a copy of this file in its image),
+so both always write and read the same format.
+"""
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from sentence_transformers import SentenceTransformer
+
+# Chunk index config (API and worker read the same variables)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+CHUNK_SIZE = int(os.getenv("RETRIEVAL_CHUNK_SIZE", 1200))
+CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", 200))
+
+@lru_cache(maxsize=None)
+def get_embedding_model(name: str = EMBEDDING_MODEL) -> SentenceTransformer:
+    """Loads each SentenceTransformer once per process."""
+    return SentenceTransformer(name)
+
+def split_markdown(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+    return splitter.split_text(text) or [text]
+
+def embed_texts(texts: List[str], model_name: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Encodes texts as L2-normalized float32 vectors (cosine similarity = dot product)."""
+    vectors = get_embedding_model(model_name).encode(texts, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32)
+
+def encode_chunk_index(chunks: List[str], vectors: np.ndarray) -> Dict:
+    """Fields of the md:chunks:{file_id} hash: JSON texts and raw float32 vectors."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return {
+        "texts": json.dumps(chunks, ensure_ascii=False).encode("utf-8"),
+        "vectors": vectors.tobytes(),
+        "count": vectors.shape[0],
+        "dim": vectors.shape[1],
+        "model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "overlap": CHUNK_OVERLAP,
+    }
+
+def decode_chunk_index(data: Dict[bytes, bytes]) -> Optional[Tuple[List[str], np.ndarray]]:
+    """
+    Reads a stored chunk index. Returns None if it is missing or was built with
+    a different model or chunking, in which case it has to be rebuilt.
+    """
+    if not data:
+        return None
+    params = (
+        data.get(b"model", b"").decode("utf-8"),
+        int(data.get(b"chunk_size", 0)),
+        int(data.get(b"overlap", 0)),
+    )
+    if params != (EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP):
+        return None
+    chunks = json.loads(data[b"texts"].decode("utf-8"))
+    vectors = np.frombuffer(data[b"vectors"], dtype=np.float32).reshape(
+        int(data[b"count"]), int(data[b"dim"])
+    )
+    return chunks, vectors
+
+def build_chunk_index(markdown: str) -> Tuple[List[str], np.ndarray]:
+    chunks = split_markdown(markdown)
+    return chunks, embed_texts(chunks)
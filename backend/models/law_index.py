@@ -0,0 +1,197 @@
+"""
+Article-level index of the procurement law (LOSNCP).
+
+The law is parsed into articles once, embedded and written to a directory:
+
+    articles.json    [{"numero", "capitulo", "texto", "tokens"}, ...]
+    embeddings.npy   float32 (n_articles, dim), L2-normalized
+    meta.json        model, source hash and sizes
+
+Loading memory-maps embeddings.npy, so every pliego-vs-ley comparison and chat
+question does one matrix-vector product instead of re-reading the whole law.
+
+Build it with:
+
+    python models/law_index.py data/raw/losncp_actualizada1702.md data/law_index
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Same model registry as the chat retrieval, so each process loads MiniLM once.
+# models/models.py runs as a script with backend/models on sys.path.
+try:
+    from models.retrieval import EMBEDDING_MODEL, get_embedding_model, get_token_encoding
+except ImportError:
+    from retrieval import EMBEDDING_MODEL, get_embedding_model, get_token_encoding
+
+# Law index config
+LAW_INDEX_DIR = os.getenv("LAW_INDEX_DIR", "")
+LAW_CONTEXT_TOKENS = int(os.getenv("LAW_CONTEXT_TOKENS", 2000))
+
+ARTICLES_FILE = "articles.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+
+# "Art. 6.-", "Artículo 24", "**Art. 1.-**", "## Art. 99 bis.-" ...
+ARTICLE_PATTERN = re.compile(
+    r"^[#*_>\s-]*Art(?:[íi]culo|\.)\s*(\d+(?:\.\d+)?(?:\s*(?:bis|ter|quater))?)",
+    re.IGNORECASE | re.MULTILINE,
+)
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+?)\s*$", re.MULTILINE)
+
+def parse_articles(markdown: str) -> List[Dict]:
+    """
+    Splits the law into articles. Each article keeps its number and the last
+    heading seen before it (título/capítulo); text before the first article is
+    kept as a "preámbulo" entry.
+    """
+    matches = list(ARTICLE_PATTERN.finditer(markdown))
+    headings = [(m.start(), m.group(1).strip("*_ ")) for m in HEADING_PATTERN.finditer(markdown)
+                if not ARTICLE_PATTERN.match(m.group(0))]
+
+    def heading_before(pos: int) -> str:
+        current = ""
+        for start, title in headings:
+            if start >= pos:
+                break
+            current = title
+        return current
+
+    articles = []
+    if not matches:
+        return [{"numero": None, "capitulo": "", "texto": markdown.strip()}] if markdown.strip() else []
+
+    preamble = markdown[: matches[0].start()].strip()
+    if preamble:
+        articles.append({"numero": "preámbulo", "capitulo": "", "texto": preamble})
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        text = markdown[match.start():end].strip()
+        if text:
+            articles.append({
+                "numero": " ".join(match.group(1).split()),
+                "capitulo": heading_before(match.start()),
+                "texto": text,
+            })
+    return articles
+
+def build_law_index(markdown: str, out_dir: str, model_name: str = EMBEDDING_MODEL) -> int:
+    """Parses, embeds and writes the index to out_dir. Returns the number of articles."""
+    articles = parse_articles(markdown)
+    encoding = get_token_encoding()
+    for article in articles:
+        article["tokens"] = len(encoding.encode(article["texto"]))
+
+    vectors = get_embedding_model(model_name).encode(
+        [article["texto"] for article in articles], normalize_embeddings=True, batch_size=64
+    )
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    with open(out / ARTICLES_FILE, "w", encoding="utf-8") as f:
+        json.dump(articles, f, ensure_ascii=False)
+    np.save(out / EMBEDDINGS_FILE, vectors)
+    meta = {
+        "model": model_name,
+        "source_sha256": hashlib.sha256(markdown.encode("utf-8")).hexdigest(),
+        "count": vectors.shape[0],
+        "dim": vectors.shape[1],
+    }
+    with open(out / META_FILE, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return len(articles)
+
+class LawIndex:
+    """Read-only article index; the embeddings stay memory-mapped on disk."""
+
+    def __init__(self, articles: List[Dict], vectors: np.ndarray, meta: Dict):
+        self.articles = articles
+        self.vectors = vectors
+        self.meta = meta
+
+    @classmethod
+    def load(cls, index_dir: str) -> "LawIndex":
+        path = Path(index_dir)
+        with open(path / ARTICLES_FILE, "r", encoding="utf-8") as f:
+            articles = json.load(f)
+        with open(path / META_FILE, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(path / EMBEDDINGS_FILE, mmap_mode="r")
+        return cls(articles, vectors, meta)
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the law text and model the index was built from."""
+        return f"{self.meta['source_sha256']}:{self.meta['model']}"
+
+    def __len__(self) -> int:
+        return len(self.articles)
+
+    def search(self, query: str, max_tokens: int = LAW_CONTEXT_TOKENS, top_k: Optional[int] = None,
+               query_vector: Optional[np.ndarray] = None) -> List[Dict]:
+        """
+        Most similar articles to the query whose combined size stays under max_tokens.
+        query_vector, if given, must come from the index's model (meta["model"]).
+        """
+        if not self.articles:
+            return []
+        if query_vector is None:
+            query_vector = get_embedding_model(self.meta["model"]).encode([query], normalize_embeddings=True)[0]
+        scores = self.vectors @ np.asarray(query_vector, dtype=np.float32)
+        order = np.argsort(-scores)
+
+        selected, total = [], 0
+        for i in order:
+            article = self.articles[i]
+            if total + article["tokens"] > max_tokens:
+                continue
+            selected.append(article)
+            total += article["tokens"]
+            if (top_k and len(selected) >= top_k) or total >= max_tokens * 0.95:
+                break
+
+        if not selected:
+            # ni el artículo más parecido cabe: se recorta
+            article = self.articles[order[0]]
+            ratio = max_tokens / max(article["tokens"], 1)
+            selected = [{**article, "texto": article["texto"][: int(len(article["texto"]) * ratio * 0.95)]}]
+        return selected
+
+    def build_context(self, query: str, max_tokens: int = LAW_CONTEXT_TOKENS, top_k: Optional[int] = None,
+                      query_vector: Optional[np.ndarray] = None) -> str:
+        """Renders the retrieved articles as Markdown, labelled by chapter."""
+        return "\n\n---\n\n".join(
+            f"## {article['capitulo']}\n\n{article['texto']}" if article["capitulo"] else article["texto"]
+            for article in self.search(query, max_tokens, top_k, query_vector)
+        )
+
+@lru_cache(maxsize=None)
+def load_law_index(index_dir: str = LAW_INDEX_DIR) -> Optional[LawIndex]:
+    """Loads the index once per process; None if LAW_INDEX_DIR is unset or not built."""
+    if not index_dir or not (Path(index_dir) / META_FILE).exists():
+        return None
+    return LawIndex.load(index_dir)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the article-level index of the procurement law.")
+    parser.add_argument("markdown", help="Law converted to Markdown.")
+    parser.add_argument("out_dir", nargs="?", default=LAW_INDEX_DIR or "data/law_index")
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    args = parser.parse_args(argv)
+
+    with open(args.markdown, "r", encoding="utf-8") as f:
+        markdown = f.read()
+    count = build_law_index(markdown, args.out_dir, args.model)
+    print(f"Indexed {count} articles into {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
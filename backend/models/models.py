@@ -6,6 +6,11 @@ import sys
 from pathlib import Path
 
 import json, re, pathlib
+import argparse
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+import threading, hashlib, tempfile
+from collections import OrderedDict
 
 MAIN_PATH = Path(sys.modules["__main__"].__file__).resolve()
 
@@ -16,7 +21,8 @@ os.chdir(MAIN_PATH.parent)
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain.chat_models import init_chat_model
 from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import START, MessagesState, StateGraph
+from langgraph.graph import START, END, MessagesState, StateGraph
+from typing_extensions import TypedDict
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader, TextLoader
@@ -25,10 +31,11 @@ from langchain_openai import ChatOpenAI  # <-- ChatGPT via LangChain
 # from langchain.chains.combine_documents import create_stuff_documents_chain
 # from langchain.chains import create_retrieval_chain
 from langchain_core.output_parsers import StrOutputParser
-import tiktoken, numpy as np
+import numpy as np
 import pickle
+import asyncio
 from sentence_transformers import SentenceTransformer
-from tenacity import retry, wait_exponential, stop_after_attempt
+from tenacity import retry, wait_exponential, wait_random_exponential, stop_after_attempt
 
 from src.config import (ContextoGeneralPliegos, PromptExtraccionPliegos,
                         ContextoGeneralPliegosvsLey, PromptExtraccionPliegosvsLey,
@@ -36,52 +43,139 @@ from src.config import (ContextoGeneralPliegos, PromptExtraccionPliegos,
                         PromptAnalisisDocsPropuestaSystem, PromptAnalisisDocsPropuestaUser,
                         ContextoGeneralOfertaPrincipalvsOtros, PromptExtraccionOfertaPrincipalvsOtros)
 from src.ocr import extract_pdf
+from law_index import load_law_index
+from retrieval import get_embedding_model, get_token_encoding as get_encoding
+from resultados import unir_resultados
 
+# licitación de ejemplo (valores por defecto del CLI)
 ID_CONTRATACION = 'LICO-GADM-S-2024-001-202671'
+OFERTAS_COMPETIDORAS = [
+    "LICO-GADM-M-2025-002-345891",
+    "LICO-GADM-P-2025-003-567123",
+    "LICO-GADM-O-2025-004-789456",
+]
+DIR_LEY_PDF = 'data/raw/losncp_actualizada1702.pdf'
+
+@dataclass
+class Licitacion:
+    """Documentos de entrada de una licitación y rutas de sus salidas."""
+    id_contratacion: str
+    dir_pliegos_pdf: str
+    dir_contrato_pdf: str
+    dir_ley_pdf: str
+    dir_oferta_ganadora: str                                   # carpeta con los .md de la oferta principal
+    ofertas_competidoras: dict = field(default_factory=dict)   # {id: carpeta con los .md}
+
+    @classmethod
+    def desde_id(cls, id_contratacion, ofertas_competidoras=None, dir_ley_pdf=DIR_LEY_PDF):
+        """Usa la estructura de carpetas por defecto de data/raw y data/generated."""
+        return cls(
+            id_contratacion=id_contratacion,
+            dir_pliegos_pdf=f'data/raw/{id_contratacion} - Pliegos.pdf',
+            dir_contrato_pdf=f'data/raw/{id_contratacion} - Contrato.pdf',
+            dir_ley_pdf=dir_ley_pdf,
+            dir_oferta_ganadora=str(Path(__file__).parent / "data" / "raw" / f"{id_contratacion} - oferta ganadora"),
+            ofertas_competidoras={
+                id_con: str(Path(__file__).parent / "data" / "generated" / f"{id_con} - oferta generada")
+                for id_con in (ofertas_competidoras or [])
+            },
+        )
+
+    def salida(self, nombre):
+        return os.path.join(f'data/outputs/{self.id_contratacion} - {nombre}')
+
+    @property
+    def dir_pliegos_llm(self):
+        return self.salida('Pliegos_llm.txt')
+
+    @property
+    def dir_pliegos_ley_llm(self):
+        return self.salida('PliegosvsLey_llm.txt')
 
-#dirs
-## pliegos
-dir_pliegos_md = os.path.join(f'data/raw/{ID_CONTRATACION} - Pliegos.md')
-dir_pliegos_pdf = os.path.join(f'data/raw/{ID_CONTRATACION} - Pliegos.pdf')
-dir_pliegos_llm = os.path.join(f'data/outputs/{ID_CONTRATACION} - Pliegos_llm.txt')
-## ley contratación
-dir_ley_md = os.path.join(f'data/raw/losncp_actualizada1702.md')
-dir_ley_pdf = os.path.join(f'data/raw/losncp_actualizada1702.pdf')
-## contrato
-dir_contrato_md = os.path.join(f'data/raw/{ID_CONTRATACION} - Contrato.md')
-dir_contrato_pdf = os.path.join(f'data/raw/{ID_CONTRATACION} - Contrato.pdf')
+    @property
+    def dir_pliegos_contrato_llm(self):
+        return self.salida('PliegosvsContrato_llm.txt')
 
-## otros
-dir_pliegos_ley_llm = os.path.join(f'data/outputs/{ID_CONTRATACION} - PliegosvsLey_llm.txt')
-dir_pliegos_contrato_llm = os.path.join(f'data/outputs/{ID_CONTRATACION} - PliegosvsContrato_llm.txt')
+    @property
+    def dir_comparacion_ofertas(self):
+        return self.salida('comparacion_ofertas.txt')
 
-dir_salida = os.path.join(f'data/outputs/{ID_CONTRATACION} - salida.json')
+    @property
+    def dir_salida(self):
+        return self.salida('salida.json')
 
-dir_comparacion_ofertas = os.path.join(f'data/outputs/{ID_CONTRATACION} - comparacion_ofertas.txt')
+    def ofertas(self):
+        """{id: carpeta} con la oferta principal primero."""
+        return {self.id_contratacion: self.dir_oferta_ganadora, **self.ofertas_competidoras}
+
+def _md_de_pdf(dir_pdf):
+    return str(Path(dir_pdf).with_suffix(".md"))
+
+def dir_consolidado(id_contratacion):
+    return f"data/outputs/{id_contratacion} - consolidado.md"
 
 #--------------------------------------------------------------------#
-# ocr
-## nuevo ocr?
-if os.path.exists(dir_pliegos_md):
-    if input("¿Desea extraer OCR pliegos nuevamente?").lower()=='si':
-        os.remove(dir_pliegos_md)
+# cache de etapas
+#--------------------------------------------------------------------#
+# Cada etapa guarda junto a su salida un "<salida>.fingerprint" con el hash de
+# sus entradas (documentos, prompts, modelo y parámetros). Si al volver a
+# ejecutar la huella coincide, la etapa se salta y se reutiliza la salida.
+def huella(*partes) -> str:
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def huella_archivo(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def _dir_huella(dir_salida) -> str:
+    return f"{dir_salida}.fingerprint"
+
+def etapa_vigente(dir_salida, fingerprint) -> bool:
+    """True si la salida existe y se generó con las mismas entradas."""
+    dir_huella = _dir_huella(dir_salida)
+    if not (os.path.exists(dir_salida) and os.path.exists(dir_huella)):
+        return False
+    with open(dir_huella, "r", encoding="utf-8") as f:
+        return f.read().strip() == fingerprint
+
+def registrar_huella(dir_salida, fingerprint):
+    with open(_dir_huella(dir_salida), "w", encoding="utf-8") as f:
+        f.write(fingerprint)
 
-if os.path.exists(dir_contrato_md):
-    if input("¿Desea extraer OCR contrato nuevamente?").lower()=='si':
-        os.remove(dir_contrato_md)
+#--------------------------------------------------------------------#
+# ocr
+def ocr_to_md(dir_pliegos_md, dir_pliegos_pdf, reocr=False):
+    """
+    Devuelve el Markdown del PDF. Solo se vuelve a extraer si el PDF cambió
+    (o si reocr=True); un .md previo sin huella se da por válido. Si solo existe
+    el .md (sin PDF), se usa tal cual.
+    """
+    if not os.path.exists(dir_pliegos_pdf):
+        if os.path.exists(dir_pliegos_md):
+            return cargar_md(dir_pliegos_md)
+        raise FileNotFoundError(f"No existe {dir_pliegos_pdf} ni {dir_pliegos_md}")
 
-if os.path.exists(dir_ley_md):
-    if input("¿Desea extraer OCR Ley Contratación Pública nuevamente?").lower()=='si':
-        os.remove(dir_ley_md)
+    fingerprint = huella("ocr", huella_archivo(dir_pliegos_pdf))
+    if os.path.exists(dir_pliegos_md):
+        if not os.path.exists(_dir_huella(dir_pliegos_md)):
+            registrar_huella(dir_pliegos_md, fingerprint)
+        if reocr or not etapa_vigente(dir_pliegos_md, fingerprint):
+            os.remove(dir_pliegos_md)
 
-## nuevo ocr?
-def ocr_to_md(dir_pliegos_md, dir_pliegos_pdf):
     if not os.path.exists(dir_pliegos_md):
         print("-"*20)
         print(f"OCR Transforming {dir_pliegos_md.split('/')[-1]}...")
         md_pliegos = extract_pdf(dir=os.path.join(dir_pliegos_pdf))
         with open(dir_pliegos_md, "w", encoding="utf-8") as f:
             f.write(md_pliegos)
+        registrar_huella(dir_pliegos_md, fingerprint)
 
     if os.path.exists(dir_pliegos_md):
         print("-"*20)
@@ -94,21 +188,18 @@ def cargar_md(path):
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
-md_pliegos = ocr_to_md(dir_pliegos_md, dir_pliegos_pdf)
-md_ley = ocr_to_md(dir_ley_md, dir_ley_pdf)
-md_contrato = ocr_to_md(dir_contrato_md, dir_contrato_pdf)
-
-md_oferta_0 = cargar_md(os.path.join(f'data/outputs/{ID_CONTRATACION} - consolidado.md'))
-md_oferta_1 = cargar_md(os.path.join(f'data/outputs/LICO-GADM-M-2025-002-345891 - consolidado.md'))
-md_oferta_2 = cargar_md(os.path.join(f'data/outputs/LICO-GADM-P-2025-003-567123 - consolidado.md'))
-md_oferta_3 = cargar_md(os.path.join(f'data/outputs/LICO-GADM-O-2025-004-789456 - consolidado.md'))
-
 #--------------------------------------------------------------------#
 # llms
 #--------------------------------------------------------------------#
 
 ## análisis pliegos
-def llm_pliegos(model_name = 'gpt-4o-mini', model_provider = 'openai'):
+def llm_pliegos(md_pliegos, dir_pliegos_llm, model_name = 'gpt-4o-mini', model_provider = 'openai', interactivo = False):
+    fingerprint = huella("llm_pliegos", _sha256(md_pliegos), ContextoGeneralPliegos,
+                         PromptExtraccionPliegos(), model_name, model_provider)
+    if not interactivo and etapa_vigente(dir_pliegos_llm, fingerprint):
+        print('Análisis pliegos sin cambios, se reutiliza la salida anterior.')
+        return cargar_md(dir_pliegos_llm)
+
     workflow = StateGraph(state_schema=MessagesState)
     model = init_chat_model(model_name, model_provider= model_provider, temperature = 0)
     prompt_template = ChatPromptTemplate.from_messages(
@@ -138,17 +229,49 @@ def llm_pliegos(model_name = 'gpt-4o-mini', model_provider = 'openai'):
     print(output["messages"][-1].content)
     with open(dir_pliegos_llm, 'w') as f:
         f.write(output["messages"][-1].content)
+    registrar_huella(dir_pliegos_llm, fingerprint)
+    respuesta = output["messages"][-1].content
 
-    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?') if interactivo else 'no'
     while continuar_conversacion.lower()=='si':
         input_text = input('¿Qué deseas saber sobre la licitación?')
         input_messages.append(HumanMessage(content="vuelve a leer el documento, responde: "+ input_text))
         output_i = app.invoke({"messages": input_messages}, config)
         print(output_i["messages"][-1].content)
         continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    return respuesta
 
 
-def llm_pliegos_vs_ley(model_name = 'gpt-4o-mini', model_provider = 'openai'):
+def llm_pliegos_vs_ley(md_pliegos, md_ley, dir_pliegos_ley_llm, model_name = 'gpt-4o-mini', model_provider = 'openai', interactivo = False,
+                       modo = None):
+    """
+    modo "map_reduce" (por defecto, ver PLIEGOS_LEY_MODO) compara el pliego por secciones
+    contra los fragmentos relevantes de la ley; "completo" manda ambos documentos enteros.
+    La conversación interactiva usa siempre el modo completo.
+    """
+    modo = "completo" if interactivo else (modo or PLIEGOS_LEY_MODO)
+    indice = load_law_index() if modo == "map_reduce" else None
+    if md_ley is None and indice is None:
+        raise ValueError("Sin índice de la ley (LAW_INDEX_DIR) hace falta el Markdown de la ley.")
+    ley_ref = indice.fingerprint if indice is not None else _sha256(md_ley)
+    fingerprint = huella("llm_pliegos_vs_ley", modo, _sha256(md_pliegos), ley_ref, ContextoGeneralPliegosvsLey,
+                         PromptExtraccionPliegosvsLey, model_name, model_provider,
+                         *((PLIEGOS_LEY_MAX_TOKENS, PLIEGOS_LEY_SECCION_TOKENS, PLIEGOS_LEY_MAX_OUTPUT_TOKENS)
+                           if modo == "map_reduce" else ()))
+    if not interactivo and etapa_vigente(dir_pliegos_ley_llm, fingerprint):
+        print('Pliegos vs. Ley sin cambios, se reutiliza la salida anterior.')
+        return cargar_md(dir_pliegos_ley_llm)
+
+    if modo == "map_reduce":
+        print('LLM procesando solicitud Pliegos vs. Ley por secciones:')
+        resultado = asyncio.run(pliegos_vs_ley_map_reduce(md_pliegos, md_ley, model_name, model_provider))
+        respuesta = json.dumps(resultado, ensure_ascii=False, indent=2)
+        print(respuesta)
+        with open(dir_pliegos_ley_llm, 'w') as f:
+            f.write(respuesta)
+        registrar_huella(dir_pliegos_ley_llm, fingerprint)
+        return respuesta
+
     workflow = StateGraph(state_schema=MessagesState)
     model = init_chat_model(model_name, model_provider= model_provider, temperature = 0)
     prompt_template = ChatPromptTemplate.from_messages(
@@ -178,16 +301,25 @@ def llm_pliegos_vs_ley(model_name = 'gpt-4o-mini', model_provider = 'openai'):
     print(output["messages"][-1].content)
     with open(dir_pliegos_ley_llm , 'w') as f:
         f.write(output["messages"][-1].content)
+    registrar_huella(dir_pliegos_ley_llm, fingerprint)
+    respuesta = output["messages"][-1].content
 
-    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?') if interactivo else 'no'
     while continuar_conversacion.lower()=='si':
         input_text = input('¿Qué deseas saber sobre la comparación?')
         input_messages.append(HumanMessage(content=input_text))
         output_i = app.invoke({"messages": input_messages}, config)
         print(output_i["messages"][-1].content)
         continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    return respuesta
+
+def llm_pliegos_vs_contrato(md_pliegos, md_contrato, dir_pliegos_contrato_llm, model_name = 'gpt-4o-mini', model_provider = 'openai', interactivo = False):
+    fingerprint = huella("llm_pliegos_vs_contrato", _sha256(md_pliegos), _sha256(md_contrato), ContextoGeneralPliegosvsContrato,
+                         PromptExtraccionPliegosvsContrato, model_name, model_provider)
+    if not interactivo and etapa_vigente(dir_pliegos_contrato_llm, fingerprint):
+        print('Pliegos vs. Contrato sin cambios, se reutiliza la salida anterior.')
+        return cargar_md(dir_pliegos_contrato_llm)
 
-def llm_pliegos_vs_contrato(model_name = 'gpt-4o-mini', model_provider = 'openai'):
     workflow = StateGraph(state_schema=MessagesState)
     model = init_chat_model(model_name, model_provider= model_provider, temperature = 0)
 
@@ -218,21 +350,99 @@ def llm_pliegos_vs_contrato(model_name = 'gpt-4o-mini', model_provider = 'openai
     print(output["messages"][-1].content)
     with open(dir_pliegos_contrato_llm, 'w') as f:
         f.write(output["messages"][-1].content)
+    registrar_huella(dir_pliegos_contrato_llm, fingerprint)
+    respuesta = output["messages"][-1].content
 
-    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?') if interactivo else 'no'
     while continuar_conversacion.lower()=='si':
         input_text = input('¿Qué deseas saber sobre la comparación?')
         input_messages.append(HumanMessage(content=input_text))
         output_i = app.invoke({"messages": input_messages}, config)
         print(output_i["messages"][-1].content)
         continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    return respuesta
+
 
 
+#--------------------------------------------------------------------#
+# registro de modelos: cada modelo/encoder se carga una vez por proceso
+EMB_BATCH_SIZE = 64
+_embedders_lock = threading.Lock()
+
+def get_embedder(emb_model: str) -> SentenceTransformer:
+    """Devuelve el SentenceTransformer `emb_model` del registro compartido con law_index (uno por proceso)."""
+    with _embedders_lock:
+        return get_embedding_model(emb_model)
 
 def estimate_tokens(text: str, enc_name: str = "o200k_base") -> int:
     """Estima tokens para modelos 4o/4.1 (usa 'cl100k_base' si prefieres)."""
-    enc = tiktoken.get_encoding(enc_name)
-    return len(enc.encode(text))
+    return len(get_encoding(enc_name).encode(text))
+
+#--------------------------------------------------------------------#
+# caché de chunks + embeddings por (hash documento, chunk_size, overlap, modelo)
+EMB_CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", 32))
+EMB_CACHE_DIR = os.getenv("EMB_CACHE_DIR", "data/cache/embeddings")  # "" = solo memoria
+_chunk_cache = OrderedDict()
+_chunk_cache_lock = threading.Lock()
+_chunk_key_locks = {}  # un lock por clave: cada documento se trocea y codifica una sola vez
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def get_chunk_embeddings(doc_text: str, chunk_size: int, overlap: int, emb_model: str):
+    """
+    Devuelve (chunks, embeddings normalizados) del documento. Se calcula una vez
+    por combinación de contenido y parámetros; se guarda en memoria (LRU) y en disco.
+    """
+    key = (_sha256(doc_text), chunk_size, overlap, emb_model)
+    with _chunk_cache_lock:
+        if key in _chunk_cache:
+            _chunk_cache.move_to_end(key)
+            return _chunk_cache[key]
+        key_lock = _chunk_key_locks.setdefault(key, threading.Lock())
+
+    # quien llega mientras otro hilo calcula la misma clave espera su resultado
+    with key_lock:
+        with _chunk_cache_lock:
+            if key in _chunk_cache:
+                _chunk_cache.move_to_end(key)
+                return _chunk_cache[key]
+        try:
+            value = _calcular_chunk_embeddings(key, doc_text)
+            with _chunk_cache_lock:
+                _chunk_cache[key] = value
+                _chunk_cache.move_to_end(key)
+                while len(_chunk_cache) > EMB_CACHE_SIZE:
+                    _chunk_cache.popitem(last=False)
+        finally:
+            with _chunk_cache_lock:
+                _chunk_key_locks.pop(key, None)
+    return value
+
+def _calcular_chunk_embeddings(key, doc_text: str):
+    """Lee los chunks de disco o los calcula y los guarda (un archivo temporal propio por escritor)."""
+    _, chunk_size, overlap, emb_model = key
+    path = None
+    if EMB_CACHE_DIR:
+        path = Path(EMB_CACHE_DIR) / f"{_sha256(repr(key))}.npz"
+    if path is not None and path.exists():
+        with np.load(path) as data:
+            return (json.loads(str(data["chunks"])), data["vectors"])
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
+    chunks = splitter.split_text(doc_text) or [doc_text]
+    M = get_embedder(emb_model).encode(chunks, normalize_embeddings=True, batch_size=EMB_BATCH_SIZE)
+    value = (chunks, np.asarray(M, dtype=np.float32))
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+            np.savez(f, chunks=np.array(json.dumps(chunks, ensure_ascii=False)), vectors=value[1])
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            os.remove(f.name)
+            raise
+    return value
 
 def select_context(topic: str, doc_text: str,
                    max_ctx_tokens: int = 6000,
@@ -240,12 +450,9 @@ def select_context(topic: str, doc_text: str,
                    overlap: int = 200,
                    emb_model: str = "sentence-transformers/all-MiniLM-L6-v2") -> str:
     """Elige los chunks más similares al topic bajo un presupuesto de tokens."""
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    chunks = splitter.split_text(doc_text) or [doc_text]
-
-    emb = SentenceTransformer(emb_model)
-    q = emb.encode([topic], normalize_embeddings=True)
-    M = emb.encode(chunks, normalize_embeddings=True)
+    # los chunks salen de la caché; solo se codifica la consulta
+    chunks, M = get_chunk_embeddings(doc_text, chunk_size, overlap, emb_model)
+    q = get_embedder(emb_model).encode([topic], normalize_embeddings=True)
     scores = (M @ q.T).ravel()
     order = np.argsort(-scores)
 
@@ -280,30 +487,52 @@ def parse_json_robusto(texto: str):
 def _invoke_chain(chain, payload):
     return chain.invoke(payload)
 
-def evaluar_tema_documento(topic: str,
-                           document_text: str,
-                           max_ctx_tokens: int = 60_000,
-                           max_output_tokens: int = 1_000):
+# backoff con jitter: con muchas llamadas en paralelo evita reintentar todas a la vez tras un 429
+@retry(wait=wait_random_exponential(multiplier=1, min=2, max=60), stop=stop_after_attempt(6))
+async def _ainvoke_chain(chain, payload):
+    return await chain.ainvoke(payload)
+
+EVAL_MODEL = "gpt-4o-mini"  # o "chatgpt-o4-nano"
+
+def _chain_evaluacion(max_output_tokens: int):
     prompt = ChatPromptTemplate.from_messages([
         ("system", PromptAnalisisDocsPropuestaSystem),
         ("user", PromptAnalisisDocsPropuestaUser)
     ])
-
-    context = select_context(topic, document_text, max_ctx_tokens=max_ctx_tokens)
-
     llm = ChatOpenAI(
-        model="gpt-4o-mini",
+        model=EVAL_MODEL,
         temperature=0,
         max_tokens=max_output_tokens,
         model_kwargs={"response_format": {"type": "json_object"}}
-    )  # o "chatgpt-o4-nano"
-    chain = prompt | llm | StrOutputParser()
+    )
+    return prompt | llm | StrOutputParser()
 
-    raw = _invoke_chain(chain, {"topic": topic, "document_text": context})
+def _parse_evaluacion(raw: str):
     try:
         return json.loads(raw)
     except Exception:
         return parse_json_robusto(raw)
+
+def evaluar_tema_documento(topic: str,
+                           document_text: str,
+                           max_ctx_tokens: int = 60_000,
+                           max_output_tokens: int = 1_000):
+    context = select_context(topic, document_text, max_ctx_tokens=max_ctx_tokens)
+    chain = _chain_evaluacion(max_output_tokens)
+    raw = _invoke_chain(chain, {"topic": topic, "document_text": context})
+    return _parse_evaluacion(raw)
+
+async def aevaluar_tema_documento(topic: str,
+                                  document_text: str,
+                                  semaforo: asyncio.Semaphore,
+                                  max_ctx_tokens: int = 60_000,
+                                  max_output_tokens: int = 1_000):
+    """Versión async de evaluar_tema_documento; `semaforo` limita los embeddings y las llamadas al LLM simultáneos."""
+    chain = _chain_evaluacion(max_output_tokens)
+    async with semaforo:
+        context = await asyncio.to_thread(select_context, topic, document_text, max_ctx_tokens=max_ctx_tokens)
+        raw = await _ainvoke_chain(chain, {"topic": topic, "document_text": context})
+    return _parse_evaluacion(raw)
     
 def listar_archivos(carpeta, recursivo= False, patron= "*", incluir_ocultos= True, sin_extension= False):
     """
@@ -321,8 +550,39 @@ def listar_archivos(carpeta, recursivo= False, patron= "*", incluir_ocultos= Tru
     ]
     return archivos
     
-def consolidar_oferta(dir_oferta, id_contratacion):
-    
+TEMA_CONSOLIDACION = 'Condiciones legales (garantías, multas, plazos), Requisitos técnicos (materiales, procesos, tiempos), Condiciones económicas (presupuestos, formas de pago)'
+EVAL_CONCURRENCY = int(os.getenv("EVAL_CONCURRENCY", 8))
+# parámetros de la consolidación; también forman parte de su huella
+CONSOLIDACION_MAX_CTX_TOKENS = 60_000      # ajusta según tu límite
+CONSOLIDACION_MAX_OUTPUT_TOKENS = 1_000
+CONSOLIDACION_UMBRAL = 0.6                 # similarity_score mínimo para entrar al consolidado
+
+async def _evaluar_documentos(oferta: dict, concurrencia: int) -> list:
+    """Evalúa todos los documentos en paralelo; devuelve los resultados en el orden de `oferta`."""
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def evaluar(ind, name_doc, markdown):
+        consulta = await aevaluar_tema_documento(
+            TEMA_CONSOLIDACION,
+            markdown,
+            semaforo,
+            max_ctx_tokens=CONSOLIDACION_MAX_CTX_TOKENS,
+            max_output_tokens=CONSOLIDACION_MAX_OUTPUT_TOKENS
+        )
+        print(f'Analizado {ind}/{len(oferta)} - {name_doc}')
+        return consulta
+
+    return await asyncio.gather(*(
+        evaluar(ind, name_doc, markdown)
+        for ind, (name_doc, markdown) in enumerate(oferta.items(), 1)
+    ))
+
+def consolidar_oferta(dir_oferta, id_contratacion, concurrencia=EVAL_CONCURRENCY):
+    """
+    Evalúa cada documento de la oferta y consolida los relevantes en un Markdown.
+    Con concurrencia > 1 los documentos se evalúan en paralelo (mismo resultado que en serie).
+    """
+
     list_files = listar_archivos(dir_oferta, incluir_ocultos= False, sin_extension= False)
     list_files_sin_extension = list(set(Path(file).stem for file in list_files))
     oferta = {}
@@ -331,16 +591,22 @@ def consolidar_oferta(dir_oferta, id_contratacion):
             markdown = f.read()
             oferta[file] = markdown
 
+    if concurrencia > 1:
+        consultas = asyncio.run(_evaluar_documentos(oferta, concurrencia))
+    else:
+        consultas = []
+        for ind, (name_doc, markdown) in enumerate(oferta.items(), 1):
+            print(f'Analizando {ind} - {name_doc}')
+            consultas.append(evaluar_tema_documento(
+                TEMA_CONSOLIDACION,
+                markdown,
+                max_ctx_tokens=CONSOLIDACION_MAX_CTX_TOKENS,
+                max_output_tokens=CONSOLIDACION_MAX_OUTPUT_TOKENS
+            ))
+
     evaluacion = {}
-    for ind, (name_doc, markdown) in enumerate(oferta.items(), 1):
-        print(f'Analizando {ind} - {name_doc}')
-        consulta = evaluar_tema_documento(
-            'Condiciones legales (garantías, multas, plazos), Requisitos técnicos (materiales, procesos, tiempos), Condiciones económicas (presupuestos, formas de pago)',
-            markdown,
-            max_ctx_tokens=60_000,              # ajusta según tu límite
-            max_output_tokens=1_000
-        )
-        if consulta['similarity_score'] >= 0.6:
+    for name_doc, consulta in zip(oferta.keys(), consultas):
+        if consulta['similarity_score'] >= CONSOLIDACION_UMBRAL:
             evaluacion[name_doc] = consulta
 
     consulta_final = ''
@@ -358,41 +624,158 @@ def consolidar_oferta(dir_oferta, id_contratacion):
     with open(f"data/outputs/{id_contratacion} - consolidado.md", "w", encoding="utf-8") as f:
         f.write(consulta_final)
 
-def consolidar_todas_ofertas():
-    id_ofertas = [
-        ID_CONTRATACION, 
-        "LICO-GADM-M-2025-002-345891",
-        "LICO-GADM-P-2025-003-567123",
-        "LICO-GADM-O-2025-004-789456"
-        ]
-    for id_con in id_ofertas:
-        if id_con == ID_CONTRATACION:
-            dir_con = Path(__file__).parent / "data" / "raw" / f"{ID_CONTRATACION} - oferta ganadora"
+def huella_consolidacion(dir_oferta) -> str:
+    """Hash de los documentos de la oferta y de todo lo que influye en su evaluación."""
+    archivos = sorted(Path(dir_oferta).glob("*.md"))
+    return huella(
+        "consolidacion",
+        *[f"{a.name}:{huella_archivo(a)}" for a in archivos],
+        PromptAnalisisDocsPropuestaSystem, PromptAnalisisDocsPropuestaUser,
+        TEMA_CONSOLIDACION, EVAL_MODEL, CONSOLIDACION_MAX_CTX_TOKENS, CONSOLIDACION_MAX_OUTPUT_TOKENS,
+        CONSOLIDACION_UMBRAL,
+    )
+
+def consolidar_todas_ofertas(ofertas: dict):
+    """Consolida cada oferta {id: carpeta} cuyos documentos cambiaron desde el último consolidado.md."""
+    for id_con, dir_con in ofertas.items():
+        fingerprint = huella_consolidacion(dir_con)
+        if Path(dir_consolidado(id_con)).exists() and not Path(_dir_huella(dir_consolidado(id_con))).exists():
+            # consolidado anterior a las huellas: se adopta tal cual
+            registrar_huella(dir_consolidado(id_con), fingerprint)
+        if etapa_vigente(dir_consolidado(id_con), fingerprint):
+            continue
+        print(f'consolidando oferta: {id_con}')
+        consolidar_oferta(Path(dir_con), id_con)
+        registrar_huella(dir_consolidado(id_con), fingerprint)
+
+#--------------------------------------------------------------------#
+# pliegos vs ley por secciones (map-reduce)
+#--------------------------------------------------------------------#
+# En lugar de un único prompt con el pliego y la ley completos, cada sección del
+# pliego se compara solo con los fragmentos de la ley más parecidos a ella, las
+# secciones se procesan en paralelo y los resultados se unen al final.
+PLIEGOS_LEY_MODO = os.getenv("PLIEGOS_LEY_MODO", "map_reduce")                   # "map_reduce" | "completo"
+PLIEGOS_LEY_MAX_TOKENS = int(os.getenv("PLIEGOS_LEY_MAX_TOKENS", 24_000))         # tope de entrada por llamada
+PLIEGOS_LEY_SECCION_TOKENS = int(os.getenv("PLIEGOS_LEY_SECCION_TOKENS", 6_000))  # tamaño máx. de sección del pliego
+PLIEGOS_LEY_MAX_OUTPUT_TOKENS = int(os.getenv("PLIEGOS_LEY_MAX_OUTPUT_TOKENS", 2_000))
+PLIEGOS_LEY_MARGEN_TOKENS = 500   # plantilla y formato de los mensajes
+LEY_CHUNK_SIZE, LEY_OVERLAP = 1200, 200                                            # troceo de la ley sin índice
+LEY_EMB_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+def dividir_secciones(markdown: str, max_tokens: int = PLIEGOS_LEY_SECCION_TOKENS) -> list:
+    """
+    Parte el Markdown por encabezados y agrupa encabezados consecutivos hasta
+    max_tokens; una sección que por sí sola lo supera se parte por párrafos.
+    """
+    bloques = [b for b in re.split(r"(?m)^(?=#{1,3} )", markdown) if b.strip()]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=max_tokens, chunk_overlap=0,
+                                              length_function=estimate_tokens)
+    secciones, actual, tokens_actual = [], [], 0
+    for bloque in bloques:
+        t = estimate_tokens(bloque)
+        if t > max_tokens:
+            partes = splitter.split_text(bloque)
         else:
-            dir_con = Path(__file__).parent / "data" / "generated" / f"{id_con} - oferta generada"
+            partes = [bloque]
+        for parte in partes:
+            t = estimate_tokens(parte)
+            if actual and tokens_actual + t > max_tokens:
+                secciones.append("".join(actual))
+                actual, tokens_actual = [], 0
+            actual.append(parte)
+            tokens_actual += t
+    if actual:
+        secciones.append("".join(actual))
+    return secciones
+
+def contexto_ley(seccion: str, md_ley: str, max_tokens: int) -> str:
+    """
+    Artículos de la ley más relevantes para la sección, dentro de max_tokens.
+    Usa el índice por artículos si está construido (LAW_INDEX_DIR); si no, trocea md_ley.
+    """
+    indice = load_law_index()
+    if indice is not None:
+        return indice.build_context(seccion, max_tokens)
+    return select_context(seccion, md_ley, max_ctx_tokens=max_tokens,
+                          chunk_size=LEY_CHUNK_SIZE, overlap=LEY_OVERLAP, emb_model=LEY_EMB_MODEL)
+
+def preparar_ley(md_ley: str):
+    """
+    Carga el índice de la ley o, si no existe, trocea y codifica md_ley una sola
+    vez; después cada sección solo codifica su consulta.
+    """
+    if load_law_index() is None:
+        get_chunk_embeddings(md_ley, LEY_CHUNK_SIZE, LEY_OVERLAP, LEY_EMB_MODEL)
+
+async def pliegos_vs_ley_map_reduce(md_pliegos, md_ley,
+                                    model_name='gpt-4o-mini',
+                                    model_provider='openai',
+                                    max_tokens=PLIEGOS_LEY_MAX_TOKENS,
+                                    seccion_tokens=PLIEGOS_LEY_SECCION_TOKENS,
+                                    max_output_tokens=PLIEGOS_LEY_MAX_OUTPUT_TOKENS,
+                                    concurrencia=EVAL_CONCURRENCY) -> dict:
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", ContextoGeneralPliegosvsLey),
+            ("system", "Documento en Markdown 1 (sección del pliego):\n{markdown_1}"),
+            ("system", "Documento en Markdown 2 (artículos relevantes de la ley):\n{markdown_2}"),
+            MessagesPlaceholder(variable_name="messages"),
+        ]
+    )
+    model = init_chat_model(model_name, model_provider=model_provider, temperature=0, max_tokens=max_output_tokens)
+    chain = prompt | model | StrOutputParser()
+    mensajes = [HumanMessage(PromptExtraccionPliegosvsLey)]
+    tokens_fijos = (estimate_tokens(ContextoGeneralPliegosvsLey) + estimate_tokens(PromptExtraccionPliegosvsLey)
+                    + PLIEGOS_LEY_MARGEN_TOKENS)
+
+    secciones = dividir_secciones(md_pliegos, seccion_tokens)
+    semaforo = asyncio.Semaphore(concurrencia)
+    await asyncio.to_thread(preparar_ley, md_ley)
+
+    async def comparar(ind, seccion):
+        presupuesto_ley = max_tokens - tokens_fijos - estimate_tokens(seccion)
+        if presupuesto_ley <= 0:
+            raise ValueError(f"La sección {ind} no cabe en PLIEGOS_LEY_MAX_TOKENS={max_tokens}.")
+        async with semaforo:
+            ley = await asyncio.to_thread(contexto_ley, seccion, md_ley, presupuesto_ley)
+            raw = await _ainvoke_chain(chain, {"markdown_1": seccion, "markdown_2": ley, "messages": mensajes})
+        print(f'Comparada sección {ind}/{len(secciones)}')
+        try:
+            return _parse_evaluacion(raw)
+        except Exception as e:
+            print(f'Respuesta no válida en la sección {ind}, se omite: {e}')
+            return {}
 
-        if not Path(f"data/outputs/{id_con} - consolidado.md").exists():
-            print(f'consolidando oferta: {id_con}')
-            consolidar_oferta(dir_con, id_con)
+    parciales = await asyncio.gather(*(comparar(ind, sec) for ind, sec in enumerate(secciones, 1)))
+    return unir_resultados(parciales)
 
 def _safe_invoke_model(model, prompt_messages):
     return model.invoke(prompt_messages)
 
 def oferta_principal_vs_otras(
+        documentos,                # Markdown consolidado de cada oferta, la principal primero
+        dir_comparacion_ofertas,
         model_name='gpt-4o-mini',
         model_provider='openai',
         *,
         per_doc_ctx_tokens=1500,   # presupuesto por documento
         chunk_size=1200,
         overlap=200,
-        max_output_tokens=700):
-    
+        max_output_tokens=700,
+        interactivo=False):
+
+    fingerprint = huella("oferta_principal_vs_otras", *[_sha256(doc) for doc in documentos],
+                         ContextoGeneralOfertaPrincipalvsOtros, PromptExtraccionOfertaPrincipalvsOtros,
+                         model_name, model_provider, per_doc_ctx_tokens, chunk_size, overlap, max_output_tokens)
+    if not interactivo and etapa_vigente(dir_comparacion_ofertas, fingerprint):
+        print('Oferta Principal vs. Otros sin cambios, se reutiliza la salida anterior.')
+        return cargar_md(dir_comparacion_ofertas)
+
     model = init_chat_model(model_name,
                             model_provider= model_provider,
                             temperature = 0,
                             max_tokens=max_output_tokens)
 
-    documentos = [md_oferta_0, md_oferta_1, md_oferta_2, md_oferta_3]
 
     def build_prompt_for_query(query_text: str):
         # Para cada documento, selecciona contexto bajo presupuesto
@@ -409,20 +792,10 @@ def oferta_principal_vs_otras(
 
         # Crea el template con placeholders y “partial” con los textos reducidos
         prompt_template = ChatPromptTemplate.from_messages(
-            [
-                ("system", ContextoGeneralOfertaPrincipalvsOtros),
-                ("system", "Documento en Markdown 0:\n{markdown_0}"),
-                ("system", "Documento en Markdown 1:\n{markdown_1}"),
-                ("system", "Documento en Markdown 2:\n{markdown_2}"),
-                ("system", "Documento en Markdown 3:\n{markdown_3}"),
-                MessagesPlaceholder(variable_name="messages"),
-            ]
-        ).partial(
-            markdown_0=reduced_docs[0],
-            markdown_1=reduced_docs[1],
-            markdown_2=reduced_docs[2],
-            markdown_3=reduced_docs[3],
-        )
+            [("system", ContextoGeneralOfertaPrincipalvsOtros)]
+            + [("system", f"Documento en Markdown {i}:\n{{markdown_{i}}}") for i in range(len(reduced_docs))]
+            + [MessagesPlaceholder(variable_name="messages")]
+        ).partial(**{f"markdown_{i}": doc for i, doc in enumerate(reduced_docs)})
         return prompt_template
 
     def call_model(state: MessagesState):
@@ -450,22 +823,19 @@ def oferta_principal_vs_otras(
     print(output["messages"][-1].content)
     with open(dir_comparacion_ofertas, 'w') as f:
         f.write(output["messages"][-1].content)
+    registrar_huella(dir_comparacion_ofertas, fingerprint)
+    respuesta = output["messages"][-1].content
 
-    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?') if interactivo else 'no'
     while continuar_conversacion.lower()=='si':
         input_text = input('¿Qué deseas saber sobre la comparación?')
         input_messages.append(HumanMessage(content=input_text))
         output_i = app.invoke({"messages": input_messages}, config)
         print(output_i["messages"][-1].content)
         continuar_conversacion = input('¿Desea continuar con la conversación usando LLM?')
+    return respuesta
 
 
-llm_pliegos()
-llm_pliegos_vs_ley()
-llm_pliegos_vs_contrato()
-consolidar_todas_ofertas()
-oferta_principal_vs_otras()
-
 
 def _show_error_context(s: str, err: json.JSONDecodeError) -> None:
     lines = s.splitlines()
@@ -512,7 +882,13 @@ def safe_json_load(obj):
         text = p.read_text(encoding='utf-8') if p.exists() else obj
     else:
         raise TypeError("Unsupported type for JSON input")
+    return safe_json_loads(text)
 
+def safe_json_loads(text: str):
+    """
+    Parses JSON text (never treated as a path, unlike safe_json_load).
+    Tries strict JSON first, then json5 (if installed), then auto-repair.
+    """
     try:
         return json.loads(text)
     except json.JSONDecodeError as e:
@@ -527,28 +903,190 @@ def safe_json_load(obj):
  
  
 
-with open(dir_pliegos_llm, 'r', encoding='utf8') as file:
-    f1  = file.read()
-with open(dir_pliegos_ley_llm, 'r', encoding='utf8') as file:
-    f2  = file.read()
-with open(dir_pliegos_contrato_llm, 'r', encoding='utf8') as file:
-    f3  = file.read()
-with open(dir_comparacion_ofertas, 'r', encoding='utf8') as file:
-    f4  = file.read()
-
-
-f1 = safe_json_load(dir_pliegos_llm)
-f2 = safe_json_load(dir_pliegos_ley_llm)
-f3 = safe_json_load(dir_pliegos_contrato_llm)
-f4 = safe_json_load(dir_comparacion_ofertas)
-
-salida_json = {
-    "id": ID_CONTRATACION,
-    "analisis_pliego" : f1,
-    "analisis_pliego_vs_ley" : f2,
-    "analisis_pliego_vs_contrato" : f3,
-    "analisis_oferta_principal_vs_otros" : f4,
-}
-
-with open(dir_salida, 'w', encoding='utf8') as json_file:
-    json.dump(salida_json, json_file, ensure_ascii=False)
\ No newline at end of file
+#--------------------------------------------------------------------#
+# pipeline de análisis como DAG: las etapas independientes corren en paralelo
+#--------------------------------------------------------------------#
+class EstadoAnalisis(TypedDict, total=False):
+    analisis_pliego: str
+    analisis_pliego_vs_ley: str
+    analisis_pliego_vs_contrato: str
+    analisis_oferta_principal_vs_otros: str
+
+def construir_pipeline(lic: Licitacion, md_pliegos, md_ley, md_contrato,
+                       model_name='gpt-4o-mini', model_provider='openai', interactivo=False):
+    """
+    START ─┬─ pliegos ──────────────────────┐
+           ├─ pliegos_vs_ley ───────────────┤
+           ├─ pliegos_vs_contrato ──────────┼─ salida ─ END
+           └─ consolidacion ─ ofertas ──────┘
+    """
+    modelo = {"model_name": model_name, "model_provider": model_provider, "interactivo": interactivo}
+
+    def nodo_pliegos(state: EstadoAnalisis):
+        return {"analisis_pliego": llm_pliegos(md_pliegos, lic.dir_pliegos_llm, **modelo)}
+
+    def nodo_pliegos_vs_ley(state: EstadoAnalisis):
+        return {"analisis_pliego_vs_ley": llm_pliegos_vs_ley(md_pliegos, md_ley, lic.dir_pliegos_ley_llm, **modelo)}
+
+    def nodo_pliegos_vs_contrato(state: EstadoAnalisis):
+        return {"analisis_pliego_vs_contrato": llm_pliegos_vs_contrato(md_pliegos, md_contrato, lic.dir_pliegos_contrato_llm, **modelo)}
+
+    def nodo_consolidacion(state: EstadoAnalisis):
+        consolidar_todas_ofertas(lic.ofertas())
+        return {}
+
+    def nodo_ofertas(state: EstadoAnalisis):
+        # los consolidados se leen aquí, después de generarlos
+        documentos = [cargar_md(dir_consolidado(id_con)) for id_con in lic.ofertas()]
+        return {"analisis_oferta_principal_vs_otros": oferta_principal_vs_otras(documentos, lic.dir_comparacion_ofertas, **modelo)}
+
+    def nodo_salida(state: EstadoAnalisis):
+        salida_json = {
+            "id": lic.id_contratacion,
+            "analisis_pliego" : safe_json_loads(state["analisis_pliego"]),
+            "analisis_pliego_vs_ley" : safe_json_loads(state["analisis_pliego_vs_ley"]),
+            "analisis_pliego_vs_contrato" : safe_json_loads(state["analisis_pliego_vs_contrato"]),
+            "analisis_oferta_principal_vs_otros" : safe_json_loads(state["analisis_oferta_principal_vs_otros"]),
+        }
+        with open(lic.dir_salida, 'w', encoding='utf8') as json_file:
+            json.dump(salida_json, json_file, ensure_ascii=False)
+        return {}
+
+    workflow = StateGraph(EstadoAnalisis)
+    workflow.add_node("pliegos", nodo_pliegos)
+    workflow.add_node("pliegos_vs_ley", nodo_pliegos_vs_ley)
+    workflow.add_node("pliegos_vs_contrato", nodo_pliegos_vs_contrato)
+    workflow.add_node("consolidacion", nodo_consolidacion)
+    workflow.add_node("ofertas", nodo_ofertas)
+    workflow.add_node("salida", nodo_salida)
+
+    for etapa in ["pliegos", "pliegos_vs_ley", "pliegos_vs_contrato", "consolidacion"]:
+        workflow.add_edge(START, etapa)
+    workflow.add_edge("consolidacion", "ofertas")
+    # salida espera a que terminen todas las ramas
+    workflow.add_edge(["pliegos", "pliegos_vs_ley", "pliegos_vs_contrato", "ofertas"], "salida")
+    workflow.add_edge("salida", END)
+    return workflow.compile()
+
+#--------------------------------------------------------------------#
+# punto de entrada: una licitación, un lote de licitaciones y CLI
+#--------------------------------------------------------------------#
+def cargar_ley(dir_ley_pdf, reocr=False):
+    """Markdown de la ley, o None si la comparación usa el índice de artículos y no hace falta leerla."""
+    if PLIEGOS_LEY_MODO == "map_reduce" and load_law_index() is not None:
+        return None
+    return ocr_to_md(_md_de_pdf(dir_ley_pdf), dir_ley_pdf, reocr)
+
+def preparar_compartidas(licitaciones, reocr=False):
+    """
+    Etapas que comparten varias licitaciones: el Markdown de la ley (y sus
+    embeddings) y los consolidados de las ofertas. Se hacen una vez, antes de
+    repartir las licitaciones entre procesos, para que ninguno escriba los
+    mismos archivos a la vez; en los procesos ya están vigentes y se reutilizan.
+    """
+    Path("data/outputs").mkdir(parents=True, exist_ok=True)
+    # si algo falla aquí, el error se reporta en la licitación que lo necesite
+    for dir_ley_pdf in dict.fromkeys(lic.dir_ley_pdf for lic in licitaciones):
+        try:
+            md_ley = cargar_ley(dir_ley_pdf, reocr)
+            if md_ley is not None and PLIEGOS_LEY_MODO == "map_reduce":
+                preparar_ley(md_ley)
+        except Exception as e:
+            print(f"No se pudo preparar la ley {dir_ley_pdf}: {e}")
+    ofertas = {}
+    for lic in licitaciones:
+        ofertas.update(lic.ofertas())
+    for id_con, dir_con in ofertas.items():
+        try:
+            consolidar_todas_ofertas({id_con: dir_con})
+        except Exception as e:
+            print(f"No se pudo consolidar la oferta {id_con}: {e}")
+
+def analizar_licitacion(lic: Licitacion, reocr=False, reocr_ley=None,
+                        model_name='gpt-4o-mini', model_provider='openai', interactivo=False) -> str:
+    """
+    Ejecuta el análisis completo y devuelve la ruta del salida.json. Con
+    interactivo=True cada etapa LLM pregunta si seguir la conversación y las
+    ramas del grafo se ejecutan de una en una.
+    """
+    print(f"Analizando licitación {lic.id_contratacion}")
+    Path("data/outputs").mkdir(parents=True, exist_ok=True)
+    md_pliegos = ocr_to_md(_md_de_pdf(lic.dir_pliegos_pdf), lic.dir_pliegos_pdf, reocr)
+    md_ley = cargar_ley(lic.dir_ley_pdf, reocr if reocr_ley is None else reocr_ley)
+    md_contrato = ocr_to_md(_md_de_pdf(lic.dir_contrato_pdf), lic.dir_contrato_pdf, reocr)
+
+    pipeline = construir_pipeline(lic, md_pliegos, md_ley, md_contrato, model_name, model_provider, interactivo)
+    pipeline.invoke({}, config={"max_concurrency": 1} if interactivo else None)
+    return lic.dir_salida
+
+def analizar_licitaciones(licitaciones, workers=1, **kwargs) -> dict:
+    """
+    Analiza varias licitaciones, hasta `workers` a la vez en procesos separados.
+    Devuelve {id: ruta del salida.json o mensaje de error}.
+    """
+    resultados = {}
+    if workers <= 1:
+        for lic in licitaciones:
+            try:
+                resultados[lic.id_contratacion] = analizar_licitacion(lic, **kwargs)
+            except Exception as e:
+                resultados[lic.id_contratacion] = f"error: {e}"
+        return resultados
+
+    # la ley y las ofertas compartidas se preparan aquí; los procesos no vuelven a extraer la ley
+    preparar_compartidas(licitaciones, kwargs.get("reocr", False))
+    kwargs = {**kwargs, "reocr_ley": False}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {lic.id_contratacion: pool.submit(analizar_licitacion, lic, **kwargs) for lic in licitaciones}
+        for id_con, futuro in futuros.items():
+            try:
+                resultados[id_con] = futuro.result()
+            except Exception as e:
+                resultados[id_con] = f"error: {e}"
+    return resultados
+
+def _cargar_lote(path):
+    """
+    Lee un JSON con una lista de licitaciones. Cada elemento es un id o un objeto
+    con los campos de Licitacion (los que falten se toman de la estructura por defecto).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    licitaciones = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"id_contratacion": item}
+        base = Licitacion.desde_id(item["id_contratacion"], item.get("ofertas_competidoras_ids", []))
+        campos = {k: v for k, v in item.items() if k in Licitacion.__dataclass_fields__}
+        licitaciones.append(Licitacion(**{**base.__dict__, **campos}))
+    return licitaciones
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis de licitaciones (pliegos, ley, contrato y ofertas).")
+    parser.add_argument("--id", dest="ids", action="append",
+                        help="ID de contratación a analizar (se puede repetir).")
+    parser.add_argument("--ofertas", nargs="*", default=OFERTAS_COMPETIDORAS,
+                        help="IDs de las ofertas competidoras (para los --id).")
+    parser.add_argument("--lote", help="JSON con una lista de licitaciones a analizar.")
+    parser.add_argument("--workers", type=int, default=1, help="Licitaciones procesadas en paralelo.")
+    parser.add_argument("--reocr", action="store_true", help="Volver a extraer el OCR aunque exista el Markdown.")
+    parser.add_argument("--modelo", default="gpt-4o-mini")
+    parser.add_argument("--interactivo", action="store_true",
+                        help="Permite seguir conversando con el LLM tras cada etapa (solo con --workers 1).")
+    args = parser.parse_args(argv)
+    if args.interactivo and args.workers > 1:
+        parser.error("--interactivo necesita --workers 1")
+
+    licitaciones = _cargar_lote(args.lote) if args.lote else []
+    licitaciones += [Licitacion.desde_id(id_con, args.ofertas) for id_con in (args.ids or [])]
+    if not licitaciones:
+        licitaciones = [Licitacion.desde_id(ID_CONTRATACION, args.ofertas)]
+
+    resultados = analizar_licitaciones(licitaciones, workers=args.workers,
+                                       reocr=args.reocr, model_name=args.modelo, interactivo=args.interactivo)
+    for id_con, resultado in resultados.items():
+        print(f"{id_con}: {resultado}")
+    return 0 if not any(str(r).startswith("error:") for r in resultados.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Unión de los resultados parciales del map-reduce pliegos vs ley.
+
+Cada sección del pliego devuelve el JSON de PromptExtraccionPliegosvsLey, con
+listas paralelas: la cláusula i se corresponde con la cita i y el semáforo i.
+"""
+import json
+from itertools import zip_longest
+
+# lista de cláusulas -> listas alineadas con ella
+LISTAS_PARALELAS = {
+    "clausulas_faltantes": ("clausulas_faltantes_cita", "semaforo_faltantes"),
+    "clausulas_contradictorias": ("clausulas_contradictorias_cita", "semaforo_contradictorias"),
+}
+# una cláusula solo falta si ninguna sección la cubre
+LISTAS_POR_INTERSECCION = {"clausulas_faltantes"}
+
+def _clave_item(item) -> str:
+    if isinstance(item, str):
+        return " ".join(item.split()).lower()
+    return json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+def _filas(parcial: dict, campo: str, alineados) -> list:
+    """Filas (cláusula, cita, semáforo) de una sección; las listas cortas se rellenan con ""."""
+    columnas = [parcial.get(campo) or []] + [parcial.get(a) or [] for a in alineados]
+    return [fila for fila in zip_longest(*columnas, fillvalue="") if fila[0] != ""]
+
+def unir_resultados(parciales: list) -> dict:
+    """
+    Une los JSON de cada sección. Las cláusulas se unen fila a fila junto con su
+    cita y su semáforo (deduplicando por la cláusula), así las listas paralelas
+    siguen alineadas. Una cláusula faltante solo se conserva si todas las
+    secciones válidas la reportan. El resto de listas se concatenan sin
+    duplicados y en orden; para los demás campos se queda el primer valor no vacío.
+    """
+    parciales = [p for p in parciales if p]  # secciones sin respuesta válida
+    unido = {}
+    vistos = {}
+    for parcial in parciales:
+        for campo, valor in parcial.items():
+            if campo in LISTAS_PARALELAS or any(campo in a for a in LISTAS_PARALELAS.values()):
+                continue
+            if isinstance(valor, list):
+                lista = unido.setdefault(campo, [])
+                claves = vistos.setdefault(campo, set())
+                for item in valor:
+                    clave = _clave_item(item)
+                    if clave not in claves:
+                        claves.add(clave)
+                        lista.append(item)
+            elif not unido.get(campo):
+                unido[campo] = valor
+
+    for campo, alineados in LISTAS_PARALELAS.items():
+        if not any(campo in p for p in parciales):
+            continue
+        filas = {}
+        secciones = {}
+        for parcial in parciales:
+            claves_seccion = set()
+            for fila in _filas(parcial, campo, alineados):
+                clave = _clave_item(fila[0])
+                filas.setdefault(clave, fila)
+                claves_seccion.add(clave)
+            for clave in claves_seccion:
+                secciones[clave] = secciones.get(clave, 0) + 1
+        if campo in LISTAS_POR_INTERSECCION:
+            filas = {clave: fila for clave, fila in filas.items() if secciones[clave] == len(parciales)}
+        columnas = list(zip(*filas.values())) or [()] * (1 + len(alineados))
+        for nombre, columna in zip((campo, *alineados), columnas):
+            unido[nombre] = list(columna)
+    return unido
@@ -0,0 +1,105 @@
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import tiktoken
+
+# Chunking, embeddings and the md:chunks format are shared with the OCR worker.
+# models/models.py runs as a script with backend/models on sys.path.
+try:
+    from models.chunk_format import (CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_MODEL, build_chunk_index,
+                                     decode_chunk_index, embed_texts, encode_chunk_index,
+                                     get_embedding_model, split_markdown)
+except ImportError:
+    from chunk_format import (CHUNK_OVERLAP, CHUNK_SIZE, EMBEDDING_MODEL, build_chunk_index,
+                              decode_chunk_index, embed_texts, encode_chunk_index,
+                              get_embedding_model, split_markdown)
+
+# Retrieval config
+TOP_K = int(os.getenv("RETRIEVAL_TOP_K", 8))
+MAX_CONTEXT_TOKENS = int(os.getenv("RETRIEVAL_MAX_CONTEXT_TOKENS", 6000))
+TOKEN_ENCODING = "o200k_base"
+
+@lru_cache(maxsize=None)
+def get_token_encoding(name: str = TOKEN_ENCODING):
+    return tiktoken.get_encoding(name)
+
+def estimate_tokens(text: str) -> int:
+    return len(get_token_encoding().encode(text))
+
+class ChunkIndex:
+    """
+    In-memory brute-force similarity index over the chunks of every document.
+    Documents are added and removed per file ID; each chat turn only embeds
+    the question and does one matrix-vector product.
+    """
+
+    def __init__(self):
+        self._documents: Dict[str, Tuple[str, List[str], np.ndarray]] = {}
+        self._view: Optional[Tuple[List[str], List[str], np.ndarray]] = None
+
+    def add(self, file_id: str, source: str, chunks: List[str], vectors: np.ndarray):
+        """Adds or replaces the chunks of one document."""
+        self._documents[file_id] = (source, chunks, vectors)
+        self._view = None
+
+    def remove(self, file_id: str):
+        if self._documents.pop(file_id, None) is not None:
+            self._view = None
+
+    def copy(self) -> "ChunkIndex":
+        """Shallow copy sharing the per-document arrays, for copy-on-write updates."""
+        clone = ChunkIndex()
+        clone._documents = dict(self._documents)
+        return clone
+
+    def _snapshot(self) -> Tuple[List[str], List[str], np.ndarray]:
+        """Concatenated (chunks, sources, vectors), rebuilt after add/remove."""
+        view = self._view
+        if view is None:
+            chunks, sources, blocks = [], [], []
+            for source, doc_chunks, vectors in self._documents.values():
+                chunks.extend(doc_chunks)
+                sources.extend([source] * len(doc_chunks))
+                blocks.append(vectors)
+            matrix = np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+            view = self._view = (chunks, sources, matrix)
+        return view
+
+    def __len__(self) -> int:
+        return sum(len(chunks) for _, chunks, _ in self._documents.values())
+
+    def search(self, query: str, top_k: int = TOP_K, max_tokens: int = MAX_CONTEXT_TOKENS,
+               query_vector: Optional[np.ndarray] = None) -> List[Tuple[str, str]]:
+        """
+        Returns up to top_k (source, chunk) pairs most similar to the query
+        whose combined size stays under max_tokens. Pass query_vector to reuse
+        an embedding of the query that was already computed.
+        """
+        chunks, sources, matrix = self._snapshot()
+        if not chunks:
+            return []
+        if query_vector is None:
+            query_vector = embed_texts([query])[0]
+        scores = matrix @ query_vector
+        order = np.argsort(-scores)
+
+        selected, total = [], 0
+        for i in order[: top_k * 3]:
+            tokens = estimate_tokens(chunks[i])
+            if total + tokens > max_tokens:
+                continue
+            selected.append((sources[i], chunks[i]))
+            total += tokens
+            if len(selected) >= top_k:
+                break
+        return selected
+
+    def build_context(self, query: str, top_k: int = TOP_K, max_tokens: int = MAX_CONTEXT_TOKENS,
+                      query_vector: Optional[np.ndarray] = None) -> str:
+        """Renders the retrieved chunks as Markdown, labelled by document."""
+        return "\n\n---\n\n".join(
+            f"# Documento: {source}\n\n{chunk}"
+            for source, chunk in self.search(query, top_k, max_tokens, query_vector)
+        )
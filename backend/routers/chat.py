@@ -1,17 +1,22 @@
+import asyncio
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Header
+from fastapi.responses import StreamingResponse
 
-from schemas.Chat import MessageRequest, HistoryMessage
+from schemas.Chat import MessageRequest, HistoryMessage, SESSION_ID_PATTERN
+from database.events import broadcaster, format_sse, listen_ocr_events
 
 # Import the new LLM service module
 from models.LLM_chatbot import (
     initialize_llm_workflow,
     reload_documents_context,
+    request_reload,
     chat_with_assistant_service,
+    stream_chat_with_assistant_service,
     get_chat_history_service,
     reset_conversation_service,
 )
@@ -20,10 +25,26 @@ from models.config import ContextoGeneral
 
 app = APIRouter(prefix="/llm", tags=["LLM Chat"])
 
+ocr_events_task = None
+
+async def on_ocr_event(event: Dict):
+    """Forwards OCR worker events to the clients and reloads the chat context when documents are ready."""
+    broadcaster.publish(event)
+    if event.get("type") == "document_ready" or (event.get("type") == "status" and event.get("processing_complete")):
+        request_reload()
+
 @app.on_event("startup")
 async def startup_event():
     """Initializes the LLM and LangGraph workflow on application startup."""
+    global ocr_events_task
     await initialize_llm_workflow()
+    # Documents become chat-ready as soon as the OCR worker announces them
+    ocr_events_task = asyncio.create_task(listen_ocr_events(on_ocr_event))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if ocr_events_task:
+        ocr_events_task.cancel()
 
 @app.post("/reload-docs", summary="Reload all Markdown documents from Redis")
 async def reload_documents() -> Dict[str, str]:
@@ -34,30 +55,59 @@ async def reload_documents() -> Dict[str, str]:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+SessionHeader = Header(None, alias="X-Session-ID", pattern=SESSION_ID_PATTERN,
+                       description="Chat session (conversation thread) ID")
+
 @app.post("/chat", summary="Send a message and get an assistant response")
-async def chat_with_assistant(request: MessageRequest) -> Dict[str, str]:
+async def chat_with_assistant(request: MessageRequest, x_session_id: Optional[str] = SessionHeader) -> Dict[str, str]:
     """Handles a single turn of the conversation."""
     try:
-        response = await chat_with_assistant_service(request.message)
+        response = await chat_with_assistant_service(request.message, request.session_id or x_session_id)
         return {"response": response}
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _sse_tokens(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        async for token in tokens:
+            yield format_sse({"token": token})
+        yield format_sse({}, event="end")
+    except Exception as e:
+        print(e)
+        yield format_sse({"detail": str(e)}, event="error")
+
+@app.post("/chat/stream", summary="Send a message and stream the assistant response")
+async def chat_with_assistant_stream(request: MessageRequest, x_session_id: Optional[str] = SessionHeader) -> StreamingResponse:
+    """
+    Same as /chat, but the answer is sent as Server-Sent Events while it is
+    generated: one `data: {"token": ...}` per chunk, then `event: end`
+    (or `event: error` with a `detail`).
+    """
+    try:
+        tokens = stream_chat_with_assistant_service(request.message, request.session_id or x_session_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        _sse_tokens(tokens),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/chat/history", summary="Get the full conversation history")
-async def get_chat_history() -> List[HistoryMessage]:
-    """Retrieves all messages for the current conversation thread."""
+async def get_chat_history(x_session_id: Optional[str] = SessionHeader) -> List[HistoryMessage]:
+    """Retrieves all messages for the session's conversation thread."""
     try:
-        history = await get_chat_history_service()
+        history = await get_chat_history_service(x_session_id)
         return [HistoryMessage(content=msg.content, type=msg.type) for msg in history]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat/reset", summary="Reset the current conversation")
-async def reset_conversation() -> Dict[str, str]:
-    """Clears the conversation history for the current thread."""
+async def reset_conversation(x_session_id: Optional[str] = SessionHeader) -> Dict[str, str]:
+    """Clears the conversation history for the session's thread."""
     try:
-        await reset_conversation_service()
+        await reset_conversation_service(x_session_id)
         return {"status": "success", "message": "Conversation history has been reset."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
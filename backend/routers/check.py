@@ -1,5 +1,13 @@
+import asyncio
+from typing import AsyncIterator
+
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
+from database.events import broadcaster, format_sse
 from database.redis import get_processing_status, set_processing_status
+from models.LLM_chatbot import is_chat_ready
+
+KEEPALIVE_SECONDS = 15
 
 router = APIRouter(prefix="/check", tags=["Data Check"])
 
@@ -17,4 +25,38 @@ async def change_status():
     Endpoint to manually start the data processing service by setting the status to True.
     """
     await set_processing_status(True)
-    return {"status": True}
\ No newline at end of file
+    return {"status": True}
+
+async def _event_stream() -> AsyncIterator[str]:
+    queue = broadcaster.subscribe()
+    try:
+        # Estado actual al conectar, para no esperar al próximo evento
+        processing_complete = await get_processing_status()
+        yield format_sse({
+            "processing_complete": processing_complete,
+            "ready": processing_complete and is_chat_ready(),
+        }, event="status")
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            data = {k: v for k, v in event.items() if k != "type"}
+            yield format_sse(data, event=event.get("type"))
+    finally:
+        broadcaster.unsubscribe(queue)
+
+@router.get("/events", tags=["Data Check"])
+async def processing_events():
+    """
+    Server-Sent Events with the processing progress, pushed as it happens:
+    `status` (on connect and when a batch starts or ends), `document_ready`
+    for each converted document, and `context_ready` once the chat has
+    reloaded (`ready: true` means every upload is processed and chat-ready).
+    """
+    return StreamingResponse(
+        _event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
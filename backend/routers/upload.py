@@ -1,10 +1,9 @@
 import logging
-import uuid 
 from typing import List
 
 from fastapi import APIRouter, File, HTTPException, UploadFile, status
 
-from database.redis import save_pdf_to_redis, redis_client, set_processing_status
+from database.redis import save_pdf_stream_to_redis, redis_client, set_processing_status
 from schemas.File import FileUploadError
 
 from utils.file import sanitize_filename
@@ -30,8 +29,8 @@ router = APIRouter(prefix="/files", tags=["Files"])
                     "example": {
                         "message": "Successfully stored 2 PDF files in Redis.",
                         "uploaded_files": [
-                            {"file_id": "a1b2c3d4-e5f6-4a7b-8c9d-0e1f2a3b4c5d", "original_filename": "document1.pdf"},
-                            {"file_id": "b2c3d4e5-f6a7-4b8c-9d0e-1f2a3b4c5d6e", "original_filename": "report.pdf"}
+                            {"file_id": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08", "original_filename": "document1.pdf", "deduplicated": False},
+                            {"file_id": "60303ae22b998861bce3b28f33eec1be758a213c86c93c076dbe9f558c11c752", "original_filename": "report.pdf", "deduplicated": True}
                         ],
                         "total_files": 2
                     }
@@ -46,11 +45,13 @@ async def upload_multiple_pdfs_to_redis(
     files: List[UploadFile] = File(..., description="List of PDF files to upload.")
 ) -> dict:
     """
-    Uploads one or more PDF files, assigns a unique ID to each, and stores them in Redis.
+    Uploads one or more PDF files, identifies each by its content hash, and stores them in Redis.
 
     This endpoint operates asynchronously and handles files efficiently:
-    - **Unique ID**: Each file is assigned a UUID v4 for robust identification.
-    - **Atomic Operations**: File content and metadata are stored in a single Redis transaction.
+    - **Content-addressed ID**: Each file is identified by the SHA-256 of its content.
+    - **Deduplication**: Re-uploading an already known file reuses its existing Markdown instead of running OCR again.
+    - **Streaming**: File content is streamed to Redis in fixed-size chunks, so memory use does not grow with file size.
+    - **Atomic Visibility**: Metadata is written only after the content is complete.
     - **Metadata Storage**: Saves the original filename and content type alongside the file.
     - **Security**: Sanitizes filenames before storing them as metadata.
 
@@ -78,26 +79,24 @@ async def upload_multiple_pdfs_to_redis(
             # 2. Validate that the file is a PDF
             await validate_pdf_file(file)
 
-            # 3. Generate a unique identifier for the file
-            file_id = str(uuid.uuid4())
             sanitized_filename = sanitize_filename(file.filename)
 
-            # 4. Read file content
-            await file.seek(0)
-            file_content = await file.read()
-
-            # 5. Prepare metadata
+            # 3. Prepare metadata (ID, size and hash are computed while streaming)
             metadata = {
-                "id": file_id,
                 "original_filename": sanitized_filename,
                 "content_type": file.content_type,
-                "size_bytes": len(file_content)
             }
 
-            # 6. Save content and metadata to Redis
-            await save_pdf_to_redis(file_id, file_content, metadata)
+            # 4. Stream content and save metadata to Redis
+            stored = await save_pdf_stream_to_redis(file, metadata)
+            if stored["deduplicated"]:
+                logger.info(f"File '{sanitized_filename}' already known as {stored['id']}. Skipping OCR.")
             
-            uploaded_files_info.append({"file_id": file_id, "original_filename": sanitized_filename})
+            uploaded_files_info.append({
+                "file_id": stored["id"],
+                "original_filename": sanitized_filename,
+                "deduplicated": stored["deduplicated"]
+            })
 
         except HTTPException:
             # Re-raise validation errors
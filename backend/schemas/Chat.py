@@ -1,7 +1,14 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+# Session IDs end up in Redis key names, so only plain tokens are accepted
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{1,64}$"
 
 class MessageRequest(BaseModel):
     message: str
+    # Conversation thread; falls back to the X-Session-ID header, then to the shared thread
+    session_id: Optional[str] = Field(None, pattern=SESSION_ID_PATTERN)
 
 class HistoryMessage(BaseModel):
     content: str
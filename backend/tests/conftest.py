@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos de la API se importan como "models.x", "database.x"... desde backend/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
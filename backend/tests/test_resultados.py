@@ -0,0 +1,71 @@
+from models.resultados import unir_resultados
+
+LEY = "Ley Orgánica del Sistema Nacional de Contratación Pública"
+
+
+def _seccion(faltantes, contradictorias):
+    return {
+        "clausulas_faltantes": [c for c, _, _ in faltantes],
+        "clausulas_faltantes_cita": [f"{LEY}, {cita}" for _, cita, _ in faltantes],
+        "semaforo_faltantes": [s for _, _, s in faltantes],
+        "clausulas_contradictorias": [c for c, _, _ in contradictorias],
+        "clausulas_contradictorias_cita": [cita for _, cita, _ in contradictorias],
+        "semaforo_contradictorias": [s for _, _, s in contradictorias],
+    }
+
+
+def _filas(unido, campo, cita, semaforo):
+    assert len(unido[campo]) == len(unido[cita]) == len(unido[semaforo])
+    return list(zip(unido[campo], unido[cita], unido[semaforo]))
+
+
+def test_listas_paralelas_siguen_alineadas():
+    unido = unir_resultados([
+        _seccion(
+            [("Artículo 30: Vigencia de la Oferta", "Artículo 30", "medio"),
+             ("Artículo 32: Adjudicación", "Artículo 32", "alto")],
+            [("IVA excluido del presupuesto", "Artículo 24", "alto"),
+             ("Plazo de 365 días", "Artículo 60", "medio")],
+        ),
+        _seccion(
+            [("Artículo 30:  vigencia de la oferta", "Artículo 30", "medio"),
+             ("Artículo 32: Adjudicación", "Artículo 32", "alto")],
+            [("Plazo de 365 días", "Artículo 60", "medio"),
+             ("Multas sin tope", "Artículo 71", "bajo")],
+        ),
+    ])
+
+    assert _filas(unido, "clausulas_faltantes", "clausulas_faltantes_cita", "semaforo_faltantes") == [
+        ("Artículo 30: Vigencia de la Oferta", f"{LEY}, Artículo 30", "medio"),
+        ("Artículo 32: Adjudicación", f"{LEY}, Artículo 32", "alto"),
+    ]
+    assert _filas(unido, "clausulas_contradictorias", "clausulas_contradictorias_cita",
+                  "semaforo_contradictorias") == [
+        ("IVA excluido del presupuesto", "Artículo 24", "alto"),
+        ("Plazo de 365 días", "Artículo 60", "medio"),
+        ("Multas sin tope", "Artículo 71", "bajo"),
+    ]
+
+
+def test_faltante_cubierto_por_otra_seccion_se_descarta():
+    unido = unir_resultados([
+        _seccion([("Artículo 4: Principios", "Artículo 4", "alto"),
+                  ("Artículo 34: Cancelación", "Artículo 34", "alto")], []),
+        _seccion([("Artículo 34: Cancelación", "Artículo 34", "alto")], []),
+        {},  # sección sin respuesta válida: no cuenta
+    ])
+
+    assert unido["clausulas_faltantes"] == ["Artículo 34: Cancelación"]
+    assert unido["clausulas_faltantes_cita"] == [f"{LEY}, Artículo 34"]
+    assert unido["semaforo_faltantes"] == ["alto"]
+    assert unido["clausulas_contradictorias"] == []
+    assert unido["semaforo_contradictorias"] == []
+
+
+def test_otros_campos():
+    unido = unir_resultados([
+        {"resumen": "", "observaciones": ["a", "b"]},
+        {"resumen": "Pliego incompleto", "observaciones": ["B", "c"]},
+    ])
+
+    assert unido == {"resumen": "Pliego incompleto", "observaciones": ["a", "b", "c"]}
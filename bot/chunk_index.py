@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+# The chunk index format is shared with the API: backend/models/chunk_format.py.
+# The Dockerfile copies it next to this file; in a checkout it is found in backend/models.
+sys.path.append(str(Path(__file__).resolve().parent.parent / "backend" / "models"))
+from chunk_format import build_chunk_index as split_and_embed, encode_chunk_index
+
+def build_chunk_index(markdown: str) -> dict:
+    """
+    Splits a Markdown document into chunks and embeds them.
+
+    Returns the fields of the md:chunks:{file_id} hash: chunk texts as a JSON
+    list and the L2-normalized vectors as raw row-major float32 bytes.
+    """
+    return encode_chunk_index(*split_and_embed(markdown))
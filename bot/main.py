@@ -2,16 +2,33 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import asyncio
+import hashlib
+import multiprocessing
 import os
 import logging
-import requests
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import Optional
 
-from ocr import extract_pdf
+import ocr
+from chunk_index import build_chunk_index
+from ocr import extract_pdf_with_info
 from redis_db import (
     redis_client,
     REDIS_HOST,
     REDIS_PORT,
+    OCR_CONSUMER_NAME,
+    download_to_file,
+    save_markdown,
+    ensure_consumer_group,
+    enqueue_ocr_job,
+    read_ocr_jobs,
+    ack_ocr_job,
+    touch_ocr_job,
+    claim_stale_ocr_jobs,
+    has_pending_ocr_jobs,
+    publish_event,
     set_processing_status,
     get_processing_status
 )
@@ -25,24 +42,109 @@ OUTPUT_DIR = "extracted_markdown_files_temp"
 METADATA_KEY_PATTERN = "pdf:meta:*"
 FILENAME_INDEX_KEY = "md:filename_to_id"
 POLLING_INTERVAL = 5
-LOCK_TIMEOUT = 600
+JOB_BLOCK_MS = POLLING_INTERVAL * 1000
+# Mientras un job corre, el worker renueva su lock y su idle en el stream,
+# así el lock puede ser corto: si el worker muere, el job se reintenta pronto
+HEARTBEAT_INTERVAL = 60
+LOCK_TIMEOUT = 3 * HEARTBEAT_INTERVAL
+# Un job sin ack se reclama cuando deja de recibir heartbeats y su lock expiró (el worker murió)
+RECLAIM_IDLE_MS = (LOCK_TIMEOUT + 60) * 1000
+RECLAIM_INTERVAL = 60
+# Marca de la migración de pdf:meta:* a la cola de jobs (se hace una sola vez)
+PENDING_UPLOADS_MIGRATION_KEY = "ocr:jobs:migrated"
+MAX_DELIVERIES = int(os.getenv("OCR_MAX_DELIVERIES", 3))
+OCR_WARMUP = os.getenv("OCR_WARMUP", "true").lower() == "true"
+CHUNK_INDEX_ENABLED = os.getenv("CHUNK_INDEX_ENABLED", "true").lower() == "true"
+
+# OCR process pool config
+OCR_MAX_WORKERS = int(os.getenv("OCR_MAX_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", OCR_MAX_WORKERS))
+OCR_SPLIT_PAGE_THRESHOLD = int(os.getenv("OCR_SPLIT_PAGE_THRESHOLD", 60))
+OCR_PAGES_PER_RANGE = int(os.getenv("OCR_PAGES_PER_RANGE", 20))
+ocr_executor: Optional[ProcessPoolExecutor] = None
+ocr_slots = asyncio.Semaphore(OCR_MAX_CONCURRENCY)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Status listener config
-API_RELOAD_URL = os.getenv("RELOAD_URL", "http://localhost:8001/reload-docs")
+# ---------------- POOL OCR ----------------
+def start_ocr_executor() -> ProcessPoolExecutor:
+    # "spawn" evita heredar estado de torch/CUDA del proceso padre
+    return ProcessPoolExecutor(
+        max_workers=OCR_MAX_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=ocr.init_worker,
+        initargs=(OCR_WARMUP,),
+    )
+
+async def run_ocr(func, *args, **kwargs):
+    """Runs an OCR function in the process pool, bounded by OCR_MAX_CONCURRENCY."""
+    async with ocr_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(ocr_executor, partial(func, *args, **kwargs))
+
+async def ocr_document(path: str) -> tuple[str, dict]:
+    """
+    OCRs a PDF. Documents above OCR_SPLIT_PAGE_THRESHOLD pages are split into
+    page ranges converted in parallel and stitched back together in order.
+    Returns the Markdown and the extraction info (path and page counts).
+    """
+    n_pages = await asyncio.to_thread(ocr.count_pages, path)
+    if n_pages <= OCR_SPLIT_PAGE_THRESHOLD:
+        markdown, info = await run_ocr(extract_pdf_with_info, dir=path)
+    else:
+        ranges = ocr.plan_page_ranges(n_pages, OCR_PAGES_PER_RANGE)
+        logger.info(f"Splitting {n_pages} pages into {len(ranges)} ranges for parallel OCR.")
+        results = await asyncio.gather(*(run_ocr(extract_pdf_with_info, dir=path, page_range=r) for r in ranges))
+        markdown = "\n\n".join(part for part, _ in results)
+        info = {
+            "text_pages": sum(i["text_pages"] for _, i in results),
+            "ocr_pages": sum(i["ocr_pages"] for _, i in results),
+        }
+    info["extraction_path"] = ocr.extraction_path(info["text_pages"], info["ocr_pages"])
+    return markdown, info
 
 # ---------------- FUNCIONES REDIS LISTENER ----------------
-async def acquire_lock(lock_key: str, timeout: int) -> bool:
-    return await redis_client.set(lock_key, "locked", nx=True, ex=timeout)
+# Solo se toca el lock si sigue guardando nuestro token
+RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+""")
+REFRESH_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("expire", KEYS[1], ARGV[2])
+end
+return 0
+""")
 
-async def release_lock(lock_key: str):
-    await redis_client.delete(lock_key)
+async def acquire_lock(lock_key: str, token: str, timeout: int) -> bool:
+    return await redis_client.set(lock_key, token, nx=True, ex=timeout)
+
+async def refresh_lock(lock_key: str, token: str, timeout: int) -> bool:
+    return bool(await REFRESH_LOCK_SCRIPT(keys=[lock_key], args=[token, timeout]))
+
+async def release_lock(lock_key: str, token: str):
+    await RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
+
+async def keep_job_alive(entry_id, lock_key: str, token: str):
+    """Heartbeat of a running job: renews its lock and resets its idle time in the stream."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            await refresh_lock(lock_key, token, LOCK_TIMEOUT)
+            await touch_ocr_job(entry_id)
+        except Exception as e:
+            logger.warning(f"Heartbeat failed for OCR job {entry_id}: {e}")
 
-async def process_pdf_from_redis(file_id: str):
+async def process_pdf_from_redis(file_id: str, token: str) -> bool:
+    """
+    Converts one queued PDF to Markdown. Returns False only if processing failed
+    and the job should be retried; every other outcome is final.
+    """
     lock_key = f"lock:ocr:{file_id}"
-    if not await acquire_lock(lock_key, LOCK_TIMEOUT):
+    if not await acquire_lock(lock_key, token, LOCK_TIMEOUT):
         logger.info(f"File {file_id} is already being processed by another worker. Skipping.")
-        return
+        return True
     
     logger.info(f"Acquired lock for file ID: {file_id}. Starting processing...")
     temp_pdf_path: Optional[str] = None
@@ -52,92 +154,155 @@ async def process_pdf_from_redis(file_id: str):
         meta_key = f"pdf:meta:{file_id}"
         markdown_hash_key = f"md:content:{file_id}"
         
-        pdf_content = await redis_client.get(content_key)
         metadata = await redis_client.hgetall(meta_key)
         
-        if not pdf_content or not metadata:
+        if not metadata or not await redis_client.exists(content_key):
             logger.warning(f"File ID {file_id} has missing content or metadata. Skipping.")
-            return
+            return True
 
         original_filename = metadata.get(b'original_filename', b'unknown').decode('utf-8')
-        temp_pdf_path = os.path.join(OUTPUT_DIR, f"{file_id}.pdf")
-        with open(temp_pdf_path, 'wb') as f:
-            f.write(pdf_content)
 
-        # Ejecutar OCR en un hilo para no bloquear el event loop
+        # Contenido ya convertido (mismo SHA-256): reutilizar el Markdown existente
+        if await redis_client.exists(markdown_hash_key):
+            logger.info(f"Markdown for {original_filename} already exists ({file_id}). Reusing it.")
+            await redis_client.hset(FILENAME_INDEX_KEY, original_filename, file_id)
+            await redis_client.delete(content_key, meta_key)
+            await publish_event("document_ready", file_id=file_id, original_filename=original_filename)
+            return True
+
+        # Un archivo por ejecución: otra ejecución del mismo file_id no lo borra
+        temp_pdf_path = os.path.join(OUTPUT_DIR, f"{file_id}-{token}.pdf")
+        await download_to_file(content_key, temp_pdf_path)
+
+        # Ejecutar OCR en el pool de procesos para no bloquear el event loop
         logger.info(f"Starting OCR for file: {original_filename}")
-        markdown_content = await asyncio.to_thread(extract_pdf, dir=temp_pdf_path)
-        logger.info(f"OCR completed for file: {original_filename}")
+        markdown_content, extraction_info = await ocr_document(temp_pdf_path)
+        logger.info(
+            f"OCR completed for file: {original_filename} "
+            f"(path={extraction_info['extraction_path']}, text_pages={extraction_info['text_pages']}, "
+            f"ocr_pages={extraction_info['ocr_pages']})"
+        )
         
         markdown_data = {
             "content": markdown_content.encode('utf-8'),
-            "original_filename": original_filename.encode('utf-8')
+            "original_filename": original_filename.encode('utf-8'),
+            # La API recarga solo los documentos cuya versión cambió
+            "version": hashlib.sha256(markdown_content.encode('utf-8')).hexdigest(),
+            **extraction_info
         }
-        await redis_client.hset(markdown_hash_key, mapping=markdown_data)
+        chunk_index = None
+        if CHUNK_INDEX_ENABLED:
+            # Embeddings se calculan en el pool, como el OCR
+            chunk_index = await run_ocr(build_chunk_index, markdown_content)
+            logger.info(f"Chunk index built for {original_filename}: {chunk_index['count']} chunks")
+        await save_markdown(file_id, markdown_data, chunk_index)
         await redis_client.hset(FILENAME_INDEX_KEY, original_filename, file_id)
         await redis_client.delete(content_key)
         await redis_client.delete(meta_key)
+        await publish_event("document_ready", file_id=file_id, original_filename=original_filename)
+        return True
 
     except Exception as e:
         logger.error(f"Error processing file ID {file_id}: {e}")
+        return False
     finally:
         if temp_pdf_path and os.path.exists(temp_pdf_path):
             os.remove(temp_pdf_path)
-        await release_lock(lock_key)
+        await release_lock(lock_key, token)
+
+async def handle_ocr_job(entry_id, fields):
+    file_id = fields.get(b'file_id', b'').decode('utf-8')
+    if not file_id:
+        await ack_ocr_job(entry_id)
+        return
+    token = uuid.uuid4().hex
+    heartbeat = asyncio.create_task(keep_job_alive(entry_id, f"lock:ocr:{file_id}", token))
+    try:
+        done = await process_pdf_from_redis(file_id, token)
+    finally:
+        heartbeat.cancel()
+    if done:
+        await ack_ocr_job(entry_id)
+    # Sin ack el job queda pendiente y se reintenta al reclamarlo
+
+async def enqueue_pending_uploads():
+    """
+    Encola los PDFs subidos antes de que existiera la cola de jobs. Es una
+    migración: la hace un solo worker, una sola vez (los PDFs subidos después
+    ya entran a la cola desde la API).
+    """
+    if not await redis_client.set(PENDING_UPLOADS_MIGRATION_KEY, OCR_CONSUMER_NAME, nx=True):
+        return
+    try:
+        async for key in redis_client.scan_iter(match=METADATA_KEY_PATTERN, count=500):
+            if await redis_client.hget(key, "status") == b"failed":
+                continue  # se descartó tras MAX_DELIVERIES; se reintenta solo si se vuelve a subir
+            await enqueue_ocr_job(key.decode('utf-8').split(':')[-1])
+    except Exception:
+        # migración incompleta: el próximo arranque la repite
+        await redis_client.delete(PENDING_UPLOADS_MIGRATION_KEY)
+        raise
 
 async def redis_listener():
     logger.info(f"Starting Redis listener service. Connecting to Redis at {REDIS_HOST}:{REDIS_PORT}...")
+    await ensure_consumer_group()
+    await enqueue_pending_uploads()
+    logger.info(f"Consuming OCR jobs as '{OCR_CONSUMER_NAME}'.")
+    loop = asyncio.get_running_loop()
+    next_reclaim = 0.0
+    # Task -> entry_id de los jobs que este worker está procesando
+    in_flight: dict[asyncio.Task, bytes] = {}
+
     while True:
         try:
-            keys = await redis_client.keys(METADATA_KEY_PATTERN)
-            if keys:
+            free_slots = OCR_MAX_CONCURRENCY - len(in_flight)
+            if free_slots <= 0:
+                # Memoria acotada: no se leen más jobs hasta que termine alguno
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                continue
+
+            jobs = []
+            if loop.time() >= next_reclaim:
+                jobs, dropped = await claim_stale_ocr_jobs(
+                    RECLAIM_IDLE_MS, free_slots, MAX_DELIVERIES, exclude=set(in_flight.values())
+                )
+                for entry_id, file_id in dropped:
+                    logger.error(f"OCR job {entry_id} (file {file_id}) failed {MAX_DELIVERIES} times. Dropping it.")
+                next_reclaim = loop.time() + RECLAIM_INTERVAL
+            if not jobs:
+                # Bloquea hasta que llegue un job: sin escaneos ni latencia de polling
+                jobs = await read_ocr_jobs(free_slots, JOB_BLOCK_MS)
+
+            if jobs:
                 if await get_processing_status():
                     await set_processing_status(False)
-                tasks = [process_pdf_from_redis(key.decode('utf-8').split(':')[-1]) for key in keys]
-                await asyncio.gather(*tasks)
-
-                remaining_keys = await redis_client.keys(METADATA_KEY_PATTERN)
-                if not remaining_keys and not await get_processing_status():
-                    await set_processing_status(True)
-            else:
-                if not await get_processing_status():
-                    await set_processing_status(True)
-                
-            await asyncio.sleep(POLLING_INTERVAL)
+                    await publish_event("status", processing_complete=False)
+                for entry_id, fields in jobs:
+                    task = asyncio.create_task(handle_ocr_job(entry_id, fields))
+                    in_flight[task] = entry_id
+                    task.add_done_callback(lambda t: in_flight.pop(t, None))
+            elif not in_flight and not await get_processing_status() and not await has_pending_ocr_jobs():
+                await set_processing_status(True)
+                # La API recarga el contexto al recibirlo; no hay polling ni llamadas HTTP
+                await publish_event("status", processing_complete=True)
         except Exception as e:
             logger.error(f"Error in Redis listener loop: {e}")
             await asyncio.sleep(POLLING_INTERVAL)
 
-# ---------------- FUNCIONES STATUS LISTENER ----------------
-async def status_listener():
-    logger.info("Starting status listener service...")
-    last_status = await get_processing_status()
-    logger.info(f"Initial processing status is: {last_status}")
-
-    while True:
-        try:
-            current_status = await get_processing_status()
-            if not last_status and current_status:
-                logger.info("Processing status changed to True. Notifying API to reload documents...")
-                try:
-                    response = requests.post(API_RELOAD_URL)
-                    response.raise_for_status()
-                    logger.info(f"API notification successful: {response.json().get('message')}")
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Error al notificar a la API: {e}")
-            
-            last_status = current_status
-            await asyncio.sleep(POLLING_INTERVAL)
-        except Exception as e:
-            logger.error(f"Error in status listener loop: {e}")
-            await asyncio.sleep(POLLING_INTERVAL)
-
 # ---------------- MAIN ----------------
 async def main():
-    await asyncio.gather(
-        redis_listener(),
-        status_listener()
-    )
+    global ocr_executor
+    ocr_executor = start_ocr_executor()
+    try:
+        if OCR_WARMUP:
+            logger.info(f"Starting {OCR_MAX_WORKERS} OCR workers and warming up models...")
+            # Una tarea por worker fuerza a lanzarlos (y calentarlos) todos ahora
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(ocr_executor, os.getpid) for _ in range(OCR_MAX_WORKERS)))
+            logger.info("OCR models ready.")
+        await redis_listener()
+    finally:
+        ocr_executor.shutdown(cancel_futures=True)
 
 if __name__ == "__main__":
     try:
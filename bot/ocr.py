@@ -1,12 +1,176 @@
-from docling.document_converter import DocumentConverter
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from docling.datamodel.accelerator_options import AcceleratorOptions
+from docling.datamodel.base_models import InputFormat
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+from docling.document_converter import DocumentConverter, PdfFormatOption
+import pypdfium2
 import torch
 
-def extract_pdf(dir="https://arxiv.org/pdf/2408.09869"):
-    source = dir
-    converter = DocumentConverter()
-    result = converter.convert(source)
+# Converter pool config
+CONVERTER_POOL_SIZE = int(os.getenv("OCR_CONVERTER_POOL_SIZE", 1))
+OCR_DO_OCR = os.getenv("OCR_DO_OCR", "true").lower() == "true"
+OCR_DO_TABLE_STRUCTURE = os.getenv("OCR_DO_TABLE_STRUCTURE", "true").lower() == "true"
+OCR_NUM_THREADS = int(os.getenv("OCR_NUM_THREADS", 4))
+OCR_DEVICE = os.getenv("OCR_DEVICE", "auto")
+
+# Text-layer fast path config
+OCR_TEXT_FAST_PATH = os.getenv("OCR_TEXT_FAST_PATH", "true").lower() == "true"
+OCR_TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_TEXT_LAYER_MIN_CHARS", 100))
+
+# Converters are expensive to build (they load the layout/table models), so each
+# process keeps up to CONVERTER_POOL_SIZE of them alive and hands them out one
+# job at a time.
+_converters: "queue.Queue[DocumentConverter]" = queue.Queue()
+_converters_created = 0
+_converters_lock = threading.Lock()
+_pdfium_lock = threading.Lock()
+
+def build_converter() -> DocumentConverter:
+    pipeline_options = PdfPipelineOptions(
+        do_ocr=OCR_DO_OCR,
+        do_table_structure=OCR_DO_TABLE_STRUCTURE,
+        accelerator_options=AcceleratorOptions(num_threads=OCR_NUM_THREADS, device=OCR_DEVICE),
+    )
+    return DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+    )
+
+@contextmanager
+def borrow_converter():
+    """Lends a pooled converter, creating it lazily if the pool is not full yet."""
+    global _converters_created
+    try:
+        converter = _converters.get_nowait()
+    except queue.Empty:
+        converter = None
+        with _converters_lock:
+            if _converters_created < CONVERTER_POOL_SIZE:
+                _converters_created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                converter = build_converter()
+            except Exception:
+                with _converters_lock:
+                    _converters_created -= 1
+                raise
+        else:
+            converter = _converters.get()
+    try:
+        yield converter
+    finally:
+        _converters.put(converter)
+
+def warmup():
+    """Loads the PDF pipeline models up front so the first job is not the slow one."""
+    with borrow_converter() as converter:
+        converter.initialize_pipeline(InputFormat.PDF)
+
+def init_worker(warm: bool = False):
+    """ProcessPoolExecutor initializer: optionally warms this worker's converter."""
+    if warm:
+        warmup()
+
+def count_pages(path: str) -> int:
+    # pdfium is not thread-safe
+    with _pdfium_lock:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def plan_page_ranges(n_pages: int, pages_per_range: int) -> list[tuple[int, int]]:
+    """Splits 1..n_pages into consecutive inclusive (start, end) ranges."""
+    return [
+        (start, min(start + pages_per_range - 1, n_pages))
+        for start in range(1, n_pages + 1, pages_per_range)
+    ]
+
+def extraction_path(text_pages: int, ocr_pages: int) -> str:
+    """Labels how a document was extracted: "text_layer", "ocr" or "mixed"."""
+    if text_pages and ocr_pages:
+        return "mixed"
+    return "text_layer" if text_pages else "ocr"
+
+def read_text_layer(path: str, page_range: tuple[int, int] | None = None) -> list[str | None]:
+    """
+    Returns the embedded text of each page in page_range, or None for pages
+    without a usable text layer (scanned pages that need OCR).
+    """
+    with _pdfium_lock:
+        pdf = pypdfium2.PdfDocument(path)
+        try:
+            start, end = page_range or (1, len(pdf))
+            texts = []
+            for index in range(start - 1, end):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                textpage.close()
+                page.close()
+                usable = len("".join(text.split())) >= OCR_TEXT_LAYER_MIN_CHARS
+                texts.append(text.strip() if usable else None)
+            return texts
+        finally:
+            pdf.close()
+
+def _convert(source, page_range: tuple[int, int] | None = None) -> str:
+    with borrow_converter() as converter:
+        if page_range:
+            result = converter.convert(source, page_range=page_range)
+        else:
+            result = converter.convert(source)
     try:
         torch.cuda.empty_cache()
     except:
         pass
-    return result.document.export_to_markdown()
\ No newline at end of file
+    return result.document.export_to_markdown()
+
+def extract_pdf_with_info(dir: str, page_range: tuple[int, int] | None = None) -> tuple[str, dict]:
+    """
+    Converts a PDF (or only the 1-based inclusive page_range of it) to Markdown.
+
+    Pages that already carry a text layer are read directly with pdfium; only
+    runs of scanned pages go through the Docling OCR pipeline. Returns the
+    Markdown and a dict with the text_pages/ocr_pages counts.
+    """
+    if not OCR_TEXT_FAST_PATH or not os.path.isfile(dir):
+        markdown = _convert(dir, page_range)
+        if page_range:
+            n_pages = page_range[1] - page_range[0] + 1
+        else:
+            n_pages = count_pages(dir) if os.path.isfile(dir) else 0
+        return markdown, {"text_pages": 0, "ocr_pages": n_pages}
+
+    texts = read_text_layer(dir, page_range)
+    first_page = page_range[0] if page_range else 1
+    ocr_pages = sum(text is None for text in texts)
+    if ocr_pages == len(texts):
+        return _convert(dir, page_range), {"text_pages": 0, "ocr_pages": ocr_pages}
+
+    # Keep page order: text pages as-is, consecutive scanned pages OCR'd as one range
+    parts = []
+    index = 0
+    while index < len(texts):
+        if texts[index] is not None:
+            parts.append(texts[index])
+            index += 1
+            continue
+        run_end = index
+        while run_end + 1 < len(texts) and texts[run_end + 1] is None:
+            run_end += 1
+        parts.append(_convert(dir, (first_page + index, first_page + run_end)))
+        index = run_end + 1
+
+    return "\n\n".join(parts), {"text_pages": len(texts) - ocr_pages, "ocr_pages": ocr_pages}
+
+def extract_pdf(dir="https://arxiv.org/pdf/2408.09869", page_range: tuple[int, int] | None = None):
+    """Converts a PDF (or only the 1-based inclusive page_range of it) to Markdown."""
+    return extract_pdf_with_info(dir, page_range)[0]
@@ -1,5 +1,8 @@
+import json
 import os
+import socket
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 
 # Redis configuration
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
@@ -14,6 +17,36 @@ redis_client = redis.Redis(
     decode_responses=False 
 )
 
+# OCR job queue (Redis Stream written by the API on upload)
+OCR_JOBS_STREAM = "ocr:jobs"
+OCR_JOBS_MAXLEN = 10_000
+OCR_CONSUMER_GROUP = os.getenv("OCR_CONSUMER_GROUP", "ocr-workers")
+OCR_CONSUMER_NAME = os.getenv("OCR_CONSUMER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+
+# Pub/sub channel the API listens on (document_ready / status events)
+OCR_EVENTS_CHANNEL = "ocr:events"
+
+# Markdown output and its persistent chunk index
+# md:content:{file_id} -> hash with the Markdown, filename and extraction info
+# md:chunks:{file_id}  -> hash with texts (JSON list), vectors (float32 bytes),
+#                         count, dim, model, chunk_size, overlap
+# md:chunk_ids         -> set of file IDs that have a chunk index
+CHUNK_INDEX_IDS_KEY = "md:chunk_ids"
+
+# Size of each GETRANGE read when copying PDF content out of Redis
+CHUNK_SIZE = 1024 * 1024  # 1MB chunks
+
+async def download_to_file(content_key: str, path: str) -> int:
+    """
+    Copies a binary value from Redis into a local file in CHUNK_SIZE pieces,
+    so large PDFs are never held in memory at once. Returns the bytes written.
+    """
+    total = await redis_client.strlen(content_key)
+    with open(path, 'wb') as f:
+        for start in range(0, total, CHUNK_SIZE):
+            f.write(await redis_client.getrange(content_key, start, start + CHUNK_SIZE - 1))
+    return total
+
 async def set_processing_status(is_processing: bool):
     """
     Sets the global processing status in Redis.
@@ -27,4 +60,114 @@ async def get_processing_status() -> bool:
     status_bytes = await redis_client.get("processing_status")
     if status_bytes is None:
         return False  # Default to False if the key doesn't exist
-    return status_bytes.decode('utf-8').lower() == 'true'
\ No newline at end of file
+    return status_bytes.decode('utf-8').lower() == 'true'
+
+async def ensure_consumer_group():
+    """
+    Creates the OCR consumer group (and the stream) if it does not exist yet.
+    """
+    try:
+        await redis_client.xgroup_create(OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def enqueue_ocr_job(file_id: str):
+    """
+    Adds a file to the OCR job queue.
+    """
+    await redis_client.xadd(OCR_JOBS_STREAM, {"file_id": file_id}, maxlen=OCR_JOBS_MAXLEN, approximate=True)
+
+async def read_ocr_jobs(count: int, block_ms: int):
+    """
+    Reads new jobs for this consumer, blocking up to block_ms until one arrives.
+    Returns a list of (entry_id, fields) tuples.
+    """
+    response = await redis_client.xreadgroup(
+        OCR_CONSUMER_GROUP, OCR_CONSUMER_NAME, {OCR_JOBS_STREAM: ">"}, count=count, block=block_ms
+    )
+    return response[0][1] if response else []
+
+async def ack_ocr_job(entry_id):
+    await redis_client.xack(OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, entry_id)
+
+async def touch_ocr_job(entry_id):
+    """
+    Resets the idle time of a job this consumer is still working on, so it is
+    not reclaimed as stale. JUSTID leaves the delivery counter untouched.
+    """
+    await redis_client.xclaim(
+        OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, OCR_CONSUMER_NAME, 0, [entry_id], justid=True
+    )
+
+async def claim_stale_ocr_jobs(min_idle_ms: int, count: int, max_deliveries: int, exclude=()):
+    """
+    Takes over jobs that another consumer read but never acknowledged (e.g. the
+    worker crashed). Jobs delivered more than max_deliveries times are acked and
+    dropped so a broken file cannot block the queue forever; their uploads are
+    marked as failed. Entry IDs in exclude (jobs this worker is still running)
+    are never claimed.
+    Returns (claimed, dropped): claimed is a list of (entry_id, fields) tuples and
+    dropped a list of (entry_id, file_id) tuples.
+    """
+    pending = await redis_client.xpending_range(
+        OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, min="-", max="+", count=count, idle=min_idle_ms
+    )
+    pending = [p for p in pending if p["message_id"] not in exclude]
+    if not pending:
+        return [], []
+
+    dropped = [p["message_id"] for p in pending if p["times_delivered"] >= max_deliveries]
+    retry = [p["message_id"] for p in pending if p["times_delivered"] < max_deliveries]
+    if dropped:
+        dropped = [(entry_id, await fail_ocr_job(entry_id)) for entry_id in dropped]
+    claimed = []
+    if retry:
+        claimed = await redis_client.xclaim(
+            OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, OCR_CONSUMER_NAME, min_idle_ms, retry
+        )
+    # Entries trimmed from the stream come back without fields
+    return [(entry_id, fields) for entry_id, fields in claimed if fields], dropped
+
+async def fail_ocr_job(entry_id) -> str:
+    """
+    Gives up on a job: acks it, marks its upload as failed and frees the PDF
+    content, so the API queues the file again if it is re-uploaded and startup
+    does not re-enqueue it. Returns the job's file ID ("" if it was trimmed).
+    """
+    entries = await redis_client.xrange(OCR_JOBS_STREAM, min=entry_id, max=entry_id)
+    file_id = entries[0][1].get(b"file_id", b"").decode("utf-8") if entries else ""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if file_id and await redis_client.exists(f"pdf:meta:{file_id}"):
+            pipe.hset(f"pdf:meta:{file_id}", "status", "failed")
+            pipe.delete(f"pdf:content:{file_id}")
+        pipe.xack(OCR_JOBS_STREAM, OCR_CONSUMER_GROUP, entry_id)
+        await pipe.execute()
+    return file_id
+
+async def has_pending_ocr_jobs() -> bool:
+    """
+    True if any consumer of the group still holds unacknowledged jobs.
+    """
+    summary = await redis_client.xpending(OCR_JOBS_STREAM, OCR_CONSUMER_GROUP)
+    return bool(summary and summary.get("pending"))
+
+async def save_markdown(file_id: str, markdown_data: dict, chunk_index: dict | None = None):
+    """
+    Stores a converted document and, if given, its chunk index in one transaction
+    so readers never see Markdown without its matching vectors. Without one, any
+    previous index is dropped (the API rebuilds it from the new Markdown).
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(f"md:content:{file_id}", mapping=markdown_data)
+        pipe.delete(f"md:chunks:{file_id}")
+        if chunk_index:
+            pipe.hset(f"md:chunks:{file_id}", mapping=chunk_index)
+            pipe.sadd(CHUNK_INDEX_IDS_KEY, file_id)
+        else:
+            pipe.srem(CHUNK_INDEX_IDS_KEY, file_id)
+        await pipe.execute()
+
+async def publish_event(event_type: str, **data):
+    """Notifies subscribers (the API) of an OCR event, e.g. a document that is ready."""
+    await redis_client.publish(OCR_EVENTS_CHANNEL, json.dumps({"type": event_type, **data}))
@@ -1,6 +1,6 @@
 import streamlit as st
 import requests
-import json, os 
+import json, os, time, uuid
 from typing import Optional, List, Dict, Any
 
 from dotenv import load_dotenv
@@ -19,7 +19,9 @@ BASE_CHAT_URL = f"{API_BASE_URL}/api/v1/llm"
 DASHBOARD_URL = f"{BASE_CHAT_URL}/dashboard"
 UPLOAD_URL = f"{API_BASE_URL}/api/v1/files/upload-pdfs/"
 STATUS_URL = f"{API_BASE_URL}/api/v1/check/status"
+EVENTS_URL = f"{API_BASE_URL}/api/v1/check/events"
 CHAT_URL = f"{BASE_CHAT_URL}/chat"
+CHAT_STREAM_URL = f"{BASE_CHAT_URL}/chat/stream"
 RESET_URL = f"{BASE_CHAT_URL}/chat/reset"
 HISTORY_URL = f"{BASE_CHAT_URL}/chat/history"
 
@@ -30,6 +32,12 @@ if "files_ready" not in st.session_state:
     st.session_state.files_ready = False
 if "dashboard_data" not in st.session_state:
     st.session_state.dashboard_data = None
+if "session_id" not in st.session_state:
+    # Cada pestaña del navegador tiene su propia conversación en el backend
+    st.session_state.session_id = str(uuid.uuid4())
+
+def session_headers() -> Dict[str, str]:
+    return {"X-Session-ID": st.session_state.session_id}
 
 # --- Funciones de la API ---
 
@@ -45,6 +53,37 @@ def check_files_status():
         st.error(f"Error al verificar el estado de los archivos: {e}")
         return False
 
+def wait_for_documents_ready(progress, timeout: int = 1800) -> bool:
+    """
+    Escucha los eventos de procesamiento (SSE) hasta que el chat tenga todos los
+    documentos cargados. El servidor avisa en cuanto termina el OCR; no se hace polling.
+    Se rinde a los `timeout` segundos en total, lleguen eventos o no.
+    """
+    deadline = time.monotonic() + timeout
+    try:
+        # el timeout de lectura es por lectura: cada evento lo reinicia, por eso se lleva el plazo aparte
+        with requests.get(EVENTS_URL, stream=True, timeout=(5, timeout)) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise requests.Timeout()
+                if not line:
+                    event = None
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "document_ready":
+                        progress.write(f"📄 Procesado: {data.get('original_filename')}")
+                    if data.get("ready"):
+                        return True
+    except requests.Timeout:
+        st.warning(f"Los archivos siguen en proceso tras {timeout // 60} minutos; vuelve a verificar el estado más tarde.")
+    except requests.RequestException as e:
+        st.error(f"Error al esperar el procesamiento de los archivos: {e}")
+    return False
+
 def upload_files(files):
     """Sube archivos PDF al servidor"""
     try:
@@ -61,17 +100,51 @@ def upload_files(files):
 def post_chat_message(message: str) -> Optional[str]:
     """Envía un mensaje a la API y devuelve la respuesta del asistente"""
     try:
-        response = requests.post(CHAT_URL, json={"message": message}, timeout=30)
+        response = requests.post(CHAT_URL, json={"message": message}, headers=session_headers(), timeout=30)
         response.raise_for_status()
         return response.json().get("response")
     except requests.RequestException as e:
         st.error(f"Error al enviar el mensaje al chat: {e}")
         return None
 
+def stream_chat_message(message: str):
+    """
+    Envía un mensaje a la API y va devolviendo la respuesta del asistente a medida que llega.
+    Si el streaming no está disponible (falla antes del primer token) se pide la respuesta completa.
+    """
+    received = False
+    try:
+        # timeout de conexión corto; entre tokens se espera hasta 120 s
+        with requests.post(CHAT_STREAM_URL, json={"message": message}, headers=session_headers(),
+                           stream=True, timeout=(5, 120)) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = None
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "error":
+                        st.error(f"Error en la respuesta del chat: {data.get('detail')}")
+                        return
+                    if event == "end":
+                        return
+                    received = True
+                    yield data.get("token", "")
+    except requests.RequestException as e:
+        if received:
+            st.error(f"Error al enviar el mensaje al chat: {e}")
+            return
+        response = post_chat_message(message)
+        if response:
+            yield response
+
 def reset_conversation():
     """Limpia el historial de la conversación en el backend"""
     try:
-        response = requests.post(RESET_URL, timeout=10)
+        response = requests.post(RESET_URL, headers=session_headers(), timeout=10)
         response.raise_for_status()
         return True
     except requests.RequestException as e:
@@ -191,6 +264,11 @@ with st.sidebar:
                     st.session_state.dashboard_data = None  # Reiniciar datos del dashboard
                 else:
                     st.error(message)
+            if success:
+                with st.status("Procesando archivos...", expanded=True) as progress:
+                    st.session_state.files_ready = wait_for_documents_ready(progress)
+                    if st.session_state.files_ready:
+                        progress.update(label="Archivos procesados y listos", state="complete")
     
     st.header("📊 Estado del Sistema")
     
@@ -253,10 +331,9 @@ with tab_chat:
         with st.chat_message("user"):
             st.markdown(prompt)
         
-        with st.spinner("Procesando..."):
-            assistant_response = post_chat_message(prompt)
+        # La respuesta se pinta a medida que llegan los tokens
+        with st.chat_message("assistant"):
+            assistant_response = st.write_stream(stream_chat_message(prompt))
 
         if assistant_response:
-            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-            with st.chat_message("assistant"):
-                st.markdown(assistant_response)
\ No newline at end of file
+            st.session_state.messages.append({"role": "assistant", "content": assistant_response})
\ No newline at end of file